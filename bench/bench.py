@@ -0,0 +1,252 @@
+#!/usr/bin/env python3
+"""usage: bench.py [options]
+       bench.py --compare <old.json> <new.json>
+
+Times `liz init` and `liz build` end to end on synthetic projects and
+reports routes per second and peak RSS for each scenario.
+
+options:
+    -h  Print this message
+    -s, --sizes <n,...>  Route counts to try (default 1000,10000)
+    -d, --depths <n,...>  Depths of the {% extends %} chain (default 1,8)
+    -p, --payloads <small,large>  Size of each route's data
+    -j, --jobs <n>  Passed on to `liz build -j`
+    -r, --repeat <n>  Runs per scenario, the fastest is kept (default 3)
+    -o, --output <file>  Write results as JSON
+    --compare  Compare two result files and flag regressions
+
+Sizes of 100000 and 1000000 routes are supported but are left out of
+the defaults since they take a while. Results carry the commit they
+were run against, so two runs can be compared between commits:
+
+    python3 bench/bench.py -o before.json
+    git checkout my-branch
+    python3 bench/bench.py -o after.json
+    python3 bench/bench.py --compare before.json after.json
+"""
+import getopt
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# A run counts as a regression when it is this much slower.
+THRESHOLD = 0.10
+
+LIZ = [sys.executable, '-m', 'liz.main']
+
+LARGE_ITEMS = 200
+
+
+def _fatal(msg):
+    print("fatal: " + msg)
+    sys.exit(1)
+
+
+def write_project(root, routes, depth, payload):
+    """Generate a liz project with `routes` pages."""
+    templates = os.path.join(root, 'templates')
+    os.makedirs(templates)
+    with open(os.path.join(root, 'liz.yml'), 'w') as f:
+        f.write("templates: templates\nbuild: build/\n"
+                "routes: routes.jsonl\n"
+                "data:\n  site: bench\n")
+
+    # layout0.html is the base; each layer extends the one before it.
+    with open(os.path.join(templates, 'layout0.html'), 'w') as f:
+        f.write('<!doctype html>\n<title>{% block title %}{% endblock %}'
+                '</title>\n<body>\n{% block body %}{% endblock %}\n'
+                '</body>\n')
+    for i in range(1, depth):
+        with open(os.path.join(templates, 'layout%d.html' % i), 'w') as f:
+            f.write('{%% extends "layout%d.html" %%}\n'
+                    '{%% block body %%}<div class="l%d">'
+                    '{{ super() }}{%% block l%d %%}{%% endblock %%}</div>'
+                    '{%% endblock %%}\n' % (i - 1, i, i))
+    with open(os.path.join(templates, 'page.html'), 'w') as f:
+        f.write('{%% extends "layout%d.html" %%}\n'
+                '{%% block title %%}{{ title }} | {{ site }}{%% endblock %%}\n'
+                '{%% block body %%}\n'
+                '<h1>{{ title }}</h1>\n'
+                '<a href="{{ url(next) }}">next</a>\n'
+                '{%% for item in items %%}<p>{{ item.text }}</p>\n'
+                '{%% endfor %%}\n'
+                '{%% endblock %%}\n' % (depth - 1))
+
+    items = []
+    if payload == 'large':
+        items = [{'text': 'Lorem ipsum dolor sit amet %d' % i}
+                 for i in range(LARGE_ITEMS)]
+    with open(os.path.join(root, 'routes.jsonl'), 'w') as f:
+        for i in range(routes):
+            f.write(json.dumps({
+                'name': 'page-%d' % i,
+                'path': 'pages/%d/%d.html' % (i // 1000, i),
+                'template': 'page.html',
+                'data': {
+                    'title': 'Page %d' % i,
+                    'next': 'page-%d' % ((i + 1) % routes),
+                    'items': items,
+                },
+            }) + '\n')
+
+
+def run(args, cwd):
+    """Run liz and return `(seconds, peak RSS in KB)`."""
+    env = dict(os.environ, PYTHONPATH=REPO)
+    start = time.perf_counter()
+    proc = subprocess.Popen(LIZ + args, cwd=cwd, env=env,
+                            stdout=subprocess.DEVNULL,
+                            stderr=subprocess.PIPE)
+    _, status, rusage = os.wait4(proc.pid, 0)
+    elapsed = time.perf_counter() - start
+    proc.returncode = os.waitstatus_to_exitcode(status)
+    stderr = proc.stderr.read().decode('utf8', 'replace')
+    proc.stderr.close()
+    if proc.returncode:
+        _fatal("'liz %s' failed:\n%s" % (' '.join(args), stderr))
+    rss = rusage.ru_maxrss
+    if sys.platform == 'darwin':
+        rss //= 1024
+    return elapsed, rss
+
+
+def bench_scenario(routes, depth, payload, jobs, repeat):
+    build_args = ['build'] + (['-j', str(jobs)] if jobs > 1 else [])
+    best = {}
+    for _ in range(repeat):
+        root = tempfile.mkdtemp(prefix='liz-bench-')
+        try:
+            timings = {'init': run(['init', '.'], root)}
+            # Replace the starter project with the generated one.
+            shutil.rmtree(os.path.join(root, 'templates'))
+            os.remove(os.path.join(root, 'liz.yml'))
+            write_project(root, routes, depth, payload)
+            timings['build'] = run(build_args, root)
+            timings['rebuild'] = run(build_args + ['-i'], root)
+        finally:
+            shutil.rmtree(root)
+        for step, (elapsed, rss) in timings.items():
+            if step not in best or elapsed < best[step]['seconds']:
+                best[step] = {'seconds': elapsed, 'peak_rss_kb': rss}
+    for step in ('build', 'rebuild'):
+        best[step]['routes_per_second'] = routes / best[step]['seconds']
+    return best
+
+
+def _commit():
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', 'HEAD'], cwd=REPO,
+            stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(old_fn, new_fn):
+    with open(old_fn) as f:
+        old = json.load(f)
+    with open(new_fn) as f:
+        new = json.load(f)
+    print("%-32s %-8s %10s %10s %8s" % (
+        'scenario', 'step', 'old', 'new', 'change'))
+    regressions = 0
+    for name, steps in sorted(new['scenarios'].items()):
+        if name not in old['scenarios']:
+            continue
+        for step, result in sorted(steps.items()):
+            before = old['scenarios'][name].get(step)
+            if not before:
+                continue
+            change = result['seconds'] / before['seconds'] - 1
+            flag = ''
+            if change > THRESHOLD:
+                flag = '  REGRESSION'
+                regressions += 1
+            print("%-32s %-8s %9.3fs %9.3fs %+7.1f%%%s" % (
+                name, step, before['seconds'], result['seconds'],
+                change * 100, flag))
+    if regressions:
+        _fatal("%d step(s) more than %d%% slower." % (
+            regressions, THRESHOLD * 100))
+
+
+def _ints(arg):
+    try:
+        return [int(n) for n in arg.split(',')]
+    except ValueError:
+        _fatal("'%s' is not a list of numbers." % arg)
+
+
+def main(argv):
+    try:
+        opts, args = getopt.getopt(argv, "hs:d:p:j:r:o:", [
+            "help", "sizes=", "depths=", "payloads=", "jobs=", "repeat=",
+            "output=", "compare"])
+    except getopt.GetoptError:
+        print(__doc__)
+        sys.exit(1)
+
+    sizes = [1000, 10000]
+    depths = [1, 8]
+    payloads = ['small', 'large']
+    jobs = 1
+    repeat = 3
+    output = None
+    for opt, arg in opts:
+        if opt in ('-h', '--help'):
+            print(__doc__)
+            sys.exit()
+        elif opt in ('-s', '--sizes'):
+            sizes = _ints(arg)
+        elif opt in ('-d', '--depths'):
+            depths = _ints(arg)
+        elif opt in ('-p', '--payloads'):
+            payloads = arg.split(',')
+        elif opt in ('-j', '--jobs'):
+            jobs = _ints(arg)[0]
+        elif opt in ('-r', '--repeat'):
+            repeat = _ints(arg)[0]
+        elif opt in ('-o', '--output'):
+            output = arg
+        elif opt == '--compare':
+            if len(args) != 2:
+                _fatal("--compare needs two result files.")
+            return compare(*args)
+    if args:
+        _fatal("unexpected arguments: " + ' '.join(args))
+
+    results = {
+        'commit': _commit(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'jobs': jobs,
+        'scenarios': {},
+    }
+    print("%-32s %10s %12s %10s %12s" % (
+        'scenario', 'build', 'routes/s', 'rebuild', 'peak RSS'))
+    for size in sizes:
+        for depth in depths:
+            for payload in payloads:
+                name = '%d-routes/depth-%d/%s' % (size, depth, payload)
+                best = bench_scenario(size, depth, payload, jobs, repeat)
+                results['scenarios'][name] = best
+                print("%-32s %9.3fs %12.0f %9.3fs %9d KB" % (
+                    name, best['build']['seconds'],
+                    best['build']['routes_per_second'],
+                    best['rebuild']['seconds'],
+                    best['build']['peak_rss_kb']))
+
+    if output:
+        with open(output, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
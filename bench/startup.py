@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+"""usage: startup.py [options]
+
+Measures how long `liz -h`, `liz init` and `liz build` spend importing
+modules, using `python -X importtime`, and fails when a command goes
+over its budget.  Each command runs a few times and the fastest run is
+kept, so a busy machine doesn't fail the check.
+
+options:
+    -h  Print this message
+    -r, --repeat <n>  Runs per command (default 5)
+    -s, --scale <factor>  Multiply every budget, e.g. for slow CI machines
+"""
+import getopt
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+LIZ = [sys.executable, '-X', 'importtime', '-m', 'liz.main']
+
+# Import time budgets in milliseconds.  `liz -h` and `liz init` need
+# little beyond the interpreter; `liz build` needs PyYAML and Jinja.
+BUDGETS = {
+    'help': 40,
+    'init': 40,
+    'build': 200,
+}
+
+
+def _fatal(msg):
+    print("fatal: " + msg)
+    sys.exit(1)
+
+
+def import_time(args, cwd):
+    """Run liz and return the milliseconds it spent importing."""
+    env = dict(os.environ, PYTHONPATH=REPO)
+    proc = subprocess.run(LIZ + args, cwd=cwd, env=env,
+                          stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+    stderr = proc.stderr.decode('utf8', 'replace')
+    if proc.returncode:
+        _fatal("'liz %s' failed:\n%s" % (' '.join(args), stderr))
+    total = 0
+    for line in stderr.splitlines():
+        if not line.startswith('import time:'):
+            continue
+        _, cumulative, name = line.split('|')
+        # Nested imports are already counted in their parent's time.
+        if cumulative.strip().isdigit() and not name.startswith('  '):
+            total += int(cumulative)
+    return total / 1000
+
+
+def measure(command, repeat):
+    best = None
+    for _ in range(repeat):
+        root = tempfile.mkdtemp(prefix='liz-startup-')
+        try:
+            if command == 'help':
+                elapsed = import_time(['-h'], root)
+            elif command == 'init':
+                elapsed = import_time(['init', '.'], root)
+            else:
+                subprocess.run(LIZ[:1] + ['-m', 'liz.main', 'init', '.'],
+                               cwd=root, stdout=subprocess.DEVNULL,
+                               env=dict(os.environ, PYTHONPATH=REPO),
+                               check=True)
+                elapsed = import_time(['build', '--no-daemon'], root)
+        finally:
+            shutil.rmtree(root)
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+
+def main(argv):
+    try:
+        opts, args = getopt.getopt(argv, "hr:s:", [
+            "help", "repeat=", "scale="])
+    except getopt.GetoptError:
+        print(__doc__)
+        sys.exit(1)
+    if args:
+        _fatal("unexpected arguments: " + ' '.join(args))
+
+    repeat = 5
+    scale = 1.0
+    for opt, arg in opts:
+        if opt in ('-h', '--help'):
+            print(__doc__)
+            sys.exit()
+        try:
+            if opt in ('-r', '--repeat'):
+                repeat = int(arg)
+            elif opt in ('-s', '--scale'):
+                scale = float(arg)
+        except ValueError:
+            _fatal("'%s' is not a number." % arg)
+
+    over = 0
+    print("%-8s %10s %10s" % ('command', 'imports', 'budget'))
+    for command, budget in BUDGETS.items():
+        budget *= scale
+        elapsed = measure(command, repeat)
+        flag = ''
+        if elapsed > budget:
+            flag = '  OVER BUDGET'
+            over += 1
+        print("%-8s %8.1fms %8.0fms%s" % (command, elapsed, budget, flag))
+    if over:
+        _fatal("%d command(s) over their import time budget." % over)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
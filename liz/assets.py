@@ -0,0 +1,146 @@
+"""Asset pipeline: compiled SCSS and fingerprinted static files.
+
+Everything in the assets directory is copied into `build/assets/` under
+a name that includes a hash of its content, e.g. `css/styles.scss`
+becomes `assets/css/styles.3f9a1c0e.css`.  Since a file's name changes
+whenever its content does, assets can be served with long-lived,
+immutable cache headers.  Templates find them through the `asset()`
+global:
+
+    <link rel="stylesheet" href="{{ asset('css/styles.css') }}">
+
+SCSS is compiled with libsass (the `sass` module).  Compiled CSS is
+cached keyed by the hashes of the source and of every file it imports,
+so stylesheets are only compiled again when one of them changes.
+Partials (files starting with `_`) are only compiled through imports.
+"""
+import os
+import re
+
+from typing import List, Optional, Set
+
+from .manifest import digest
+from .output import atomic_write
+
+SCSS_EXTENSIONS = ('.scss', '.sass')
+
+# Characters of the content hash put into file names.
+FINGERPRINT_LENGTH = 8
+
+_IMPORT = re.compile(r'@(?:import|use|forward)\s+([^;]+);')
+
+
+class AssetMap(dict):
+    """Maps asset names to their fingerprinted URLs; used as `asset()`."""
+
+    def __call__(self, name: str) -> str:
+        try:
+            return self[name.lstrip('/')]
+        except KeyError:
+            raise KeyError("no asset named '%s'." % name)
+
+
+def _fingerprint(name: str, content: bytes) -> str:
+    root, ext = os.path.splitext(name)
+    return '%s.%s%s' % (root, digest(content)[:FINGERPRINT_LENGTH], ext)
+
+
+def _resolve(name: str, paths: List[str]) -> Optional[str]:
+    head, tail = os.path.split(name)
+    candidates = [name]
+    for ext in SCSS_EXTENSIONS:
+        candidates += [name + ext, os.path.join(head, '_' + tail + ext),
+                       os.path.join(name, '_index' + ext),
+                       os.path.join(name, 'index' + ext)]
+    for path in paths:
+        for candidate in candidates:
+            filename = os.path.join(path, candidate)
+            if os.path.isfile(filename):
+                return filename
+    return None
+
+
+def scss_imports(filename: str, include_paths: List[str],
+                 seen: Optional[Set[str]] = None) -> Set[str]:
+    """Find every file `filename` imports, directly or not."""
+    if seen is None:
+        seen = set()
+    with open(filename, 'r') as f:
+        source = f.read()
+    paths = [os.path.dirname(filename)] + include_paths
+    for match in _IMPORT.finditer(source):
+        for words in match.group(1).split(','):
+            words = words.split()
+            if not words:
+                continue
+            name = words[0].strip('\'"')
+            # Plain CSS imports are left to the browser, and `sass:`
+            # modules are built in.
+            if (name.endswith('.css') or '://' in name or
+                    name.startswith(('url(', 'sass:'))):
+                continue
+            imported = _resolve(name, paths)
+            if imported and imported not in seen:
+                seen.add(imported)
+                scss_imports(imported, include_paths, seen)
+    return seen
+
+
+def compile_scss(filename: str, include_paths: List[str],
+                 cache_dir: str) -> bytes:
+    """Compile a stylesheet, reusing the cached CSS if nothing changed."""
+    deps = sorted(scss_imports(filename, include_paths))
+    hashes = []
+    for dep in [filename] + deps:
+        with open(dep, 'rb') as f:
+            hashes.append(digest(f.read()))
+    key = digest(' '.join(hashes).encode('utf8'))
+    cache_fn = os.path.join(cache_dir, key + '.css')
+    try:
+        with open(cache_fn, 'rb') as f:
+            return f.read()
+    except OSError:
+        pass
+
+    try:
+        import sass
+    except ImportError:
+        raise RuntimeError("compiling '%s' needs libsass installed." %
+                           filename)
+    try:
+        css = sass.compile(filename=filename,
+                           include_paths=include_paths).encode('utf8')
+    except sass.CompileError as e:
+        raise RuntimeError("couldn't compile '%s': %s" % (filename, e))
+    os.makedirs(cache_dir, exist_ok=True)
+    atomic_write(cache_fn, css)
+    return css
+
+
+def build_assets(assets_dir: str, build_dir: str, cache_dir: str,
+                 dry_run: bool = False) -> AssetMap:
+    """Write fingerprinted assets to `build_dir` and map their names."""
+    assets = AssetMap()
+    scss_cache = os.path.join(cache_dir, 'scss')
+    for dirpath, _, filenames in os.walk(assets_dir):
+        for fn in sorted(filenames):
+            filename = os.path.join(dirpath, fn)
+            name = os.path.relpath(filename, assets_dir).replace(os.sep, '/')
+            root, ext = os.path.splitext(name)
+            if ext in SCSS_EXTENSIONS:
+                if fn.startswith('_'):
+                    continue
+                content = compile_scss(filename, [assets_dir], scss_cache)
+                name = root + '.css'
+            else:
+                with open(filename, 'rb') as f:
+                    content = f.read()
+            output = 'assets/' + _fingerprint(name, content)
+            assets[name] = '/' + output
+            path = os.path.join(build_dir, *output.split('/'))
+            # Same name, same content: nothing to write.
+            if dry_run or os.path.exists(path):
+                continue
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            atomic_write(path, content)
+    return assets
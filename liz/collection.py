@@ -0,0 +1,142 @@
+"""Collection routes: one route declaration for many pages.
+
+A route with a `collection` points at a data source and a path
+pattern, and expands into one route per item when routes are walked:
+
+    routes:
+      - collection: products.jsonl
+        path: products/{slug}.html
+        name: product-{slug}
+        template: product.html
+        paginate:
+          path: products/{page}.html
+          name: products-{page}
+          template: products.html
+          per-page: 50
+
+The source is a JSON Lines file, a JSON or YAML list, or a directory
+of data files with one item each; items from a directory get the file
+name (without extension) as their `slug` unless they set one.  Files
+that aren't JSON or YAML are read like `!data-doc` files.
+
+Patterns are filled in from each item with `str.format`.  Item pages
+get the item as `item` (or the key set with `as`), index pages get
+`page` with its `number`, its `entries` and the `url()` names of the
+`previous` and `next` pages.  Routes without a `name` are named after
+their path.  Sources are read again on every pass over the routes, so
+the items never have to be held in memory all at once.
+"""
+import os
+
+from typing import Any, Dict, Iterable, Iterator, List
+
+from .data import RouteStream, _filetype, _parse_data_doc, load_file
+from .main import _fatal
+
+DEFAULT_PER_PAGE = 20
+
+
+def iter_items(source: str) -> Iterator[Dict[Any, Any]]:
+    """Yield the items of a collection one at a time."""
+    if os.path.isdir(source):
+        for dirpath, dirnames, filenames in os.walk(source):
+            dirnames.sort()
+            for fn in sorted(filenames):
+                filename = os.path.join(dirpath, fn)
+                if _filetype(fn) in ('json', 'yaml'):
+                    item = load_file(filename, _filetype(fn))
+                else:
+                    # Read directly rather than through the file cache
+                    # of `!data-doc` tags, which would keep every item.
+                    with open(filename) as f:
+                        item = _parse_data_doc(f.read())
+                item = dict(item or {})
+                item.setdefault('slug', os.path.splitext(fn)[0])
+                yield item
+    elif _filetype(source) == 'jsonl':
+        yield from RouteStream(source)
+    else:
+        items = load_file(source, _filetype(source))
+        if not isinstance(items, list):
+            _fatal("collection '%s' isn't a list." % source)
+        yield from items
+
+
+def _format(pattern: str, values: Dict[Any, Any], source: str) -> str:
+    try:
+        return pattern.format_map(values)
+    except (KeyError, IndexError, AttributeError) as e:
+        _fatal("can't fill in '%s' from an item of '%s': %s." % (
+            pattern, source, e))
+
+
+def _pages(route: Dict[Any, Any], items: Iterable[Dict[Any, Any]],
+           source: str) -> Iterator[Dict[Any, Any]]:
+    paginate = route['paginate']
+    per_page = int(paginate.get('per-page', DEFAULT_PER_PAGE))
+    if per_page < 1:
+        _fatal("'per-page' of '%s' must be at least 1." % source)
+    name_pattern = paginate.get('name') or paginate['path']
+
+    def name(number: int) -> str:
+        return _format(name_pattern, {'page': number}, source)
+
+    def page(number: int, chunk: List, more: bool) -> Dict[Any, Any]:
+        data = dict(paginate.get('data') or {})
+        data['page'] = {
+            'number': number,
+            'entries': chunk,
+            'previous': name(number - 1) if number > 1 else None,
+            'next': name(number + 1) if more else None,
+        }
+        return {
+            'name': name(number),
+            'path': _format(paginate['path'], {'page': number}, source),
+            'template': paginate['template'],
+            'data': data,
+        }
+
+    # Pages are yielded one behind, so each knows if another follows.
+    number = 1
+    chunk = []  # type: List
+    for item in items:
+        if len(chunk) == per_page:
+            yield page(number, chunk, True)
+            number += 1
+            chunk = []
+        chunk.append(item)
+    if chunk or number == 1:
+        yield page(number, chunk, False)
+
+
+def expand(route: Dict[Any, Any]) -> Iterator[Dict[Any, Any]]:
+    """Yield the routes a collection route stands for."""
+    source = route['collection']
+    if not os.path.exists(source):
+        _fatal("collection '%s' doesn't exist." % source)
+    key = route.get('as', 'item')
+    path_pattern = route.get('path')
+    name_pattern = route.get('name') or path_pattern
+    template = route.get('template')
+    if path_pattern and template:
+        for item in iter_items(source):
+            data = dict(route.get('data') or {})
+            data[key] = item
+            yield {
+                'name': _format(name_pattern, item, source),
+                'path': _format(path_pattern, item, source),
+                'template': template,
+                'data': data,
+            }
+    if route.get('paginate'):
+        yield from _pages(route, iter_items(source), source)
+
+
+def expand_routes(routes: Iterable[Dict[Any, Any]]
+                  ) -> Iterator[Dict[Any, Any]]:
+    """Yield `routes` with every collection route expanded in place."""
+    for route in routes:
+        if isinstance(route, dict) and 'collection' in route:
+            yield from expand(route)
+        else:
+            yield route
@@ -0,0 +1,97 @@
+"""Precompressed variants of build outputs.
+
+Writes `.gz` (and `.br`, when the `brotli` module is installed) files
+next to text outputs so a web server or CDN can serve them as they are
+instead of compressing on every request.  A variant is only written
+when it's missing or when the build changed its source, going by the
+content hashes in the build manifest rather than by timestamps, so
+files left alone by the build aren't compressed again.
+"""
+import gzip
+import os
+
+from concurrent.futures import ThreadPoolExecutor
+from typing import Container, Dict, Iterable, List, Optional
+
+from .output import atomic_write
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+COMPRESSIBLE = ('.html', '.css', '.js', '.json', '.xml', '.svg', '.txt')
+
+# Files smaller than this aren't worth compressing.
+MIN_SIZE = 1024
+
+
+def _gzip(content: bytes) -> bytes:
+    # A fixed mtime keeps the output the same from build to build.
+    return gzip.compress(content, compresslevel=9, mtime=0)
+
+
+def _brotli(content: bytes) -> bytes:
+    return brotli.compress(content)
+
+
+def compress_file(path: str, encoders: Dict[str, object],
+                  min_size: int = MIN_SIZE,
+                  changed: bool = True) -> List[str]:
+    """Write compressed variants of `path`, returning those written.
+
+    Unless `path` `changed`, only missing variants are written.
+    """
+    try:
+        st = os.stat(path)
+    except OSError:
+        return []
+    if st.st_size < min_size:
+        # Variants of what it was before it shrank would be wrong.
+        remove_variants(path)
+        return []
+    stale = [ext for ext in encoders
+             if changed or not os.path.exists(path + ext)]
+    if not stale:
+        return []
+    with open(path, 'rb') as f:
+        content = f.read()
+    written = []
+    for ext in stale:
+        atomic_write(path + ext, encoders[ext](content))
+        written.append(path + ext)
+    return written
+
+
+def compress_outputs(paths: Iterable[str], min_size: int = MIN_SIZE,
+                     use_brotli: bool = True,
+                     jobs: Optional[int] = None,
+                     changed: Container[str] = ()) -> int:
+    """Compress text outputs in a pool of threads.
+
+    `changed` holds the paths this build wrote new content to; the
+    others keep the variants they already have.
+
+    zlib and brotli release the GIL while compressing, so threads
+    keep every core busy without pickling file contents between
+    processes.
+    """
+    encoders = {'.gz': _gzip}
+    if use_brotli and brotli is not None:
+        encoders['.br'] = _brotli
+    paths = [path for path in paths if path.endswith(COMPRESSIBLE)]
+    written = 0
+    with ThreadPoolExecutor(jobs or os.cpu_count()) as pool:
+        for variants in pool.map(
+                lambda path: compress_file(path, encoders, min_size,
+                                           path in changed), paths):
+            written += len(variants)
+    return written
+
+
+def remove_variants(path: str) -> None:
+    for ext in ('.gz', '.br'):
+        try:
+            os.remove(path + ext)
+        except FileNotFoundError:
+            pass
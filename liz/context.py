@@ -0,0 +1,65 @@
+"""Layered, read-only data for rendering routes.
+
+Every route is rendered with its own `data` layered over the global
+`data` from liz.yml, which in turn sits below nothing but the template
+globals of the Jinja environment.  Layers are looked up, never copied
+or merged, so routes share the global data without being able to
+change it or see each other's keys.
+
+Each layer hashes its own dict once and combines that with the hash of
+its parent, so the global data is hashed once per build rather than
+once per route.
+"""
+from collections.abc import Mapping
+from typing import Any, Dict, Iterator, List, Optional
+
+from .manifest import digest, fingerprint
+
+
+class Layer(Mapping):
+    """A dict looked up before its parent layer."""
+    __slots__ = ('data', 'parent', '_fingerprint')
+
+    def __init__(self, data: Dict, parent: Optional['Layer'] = None):
+        self.data = data
+        self.parent = parent
+        self._fingerprint = None  # type: Optional[str]
+
+    def __getitem__(self, key: Any) -> Any:
+        if key in self.data:
+            return self.data[key]
+        if self.parent is not None:
+            return self.parent[key]
+        raise KeyError(key)
+
+    def __contains__(self, key: Any) -> bool:
+        return key in self.data or (self.parent is not None and
+                                    key in self.parent)
+
+    def __iter__(self) -> Iterator:
+        yield from self.data
+        if self.parent is not None:
+            for key in self.parent:
+                if key not in self.data:
+                    yield key
+
+    def __len__(self) -> int:
+        return sum(1 for _ in self)
+
+    def __repr__(self) -> str:
+        return 'Layer(%r)' % dict(self)
+
+    def layers(self) -> List['Layer']:
+        """This layer and its parents, outermost first."""
+        layers = [] if self.parent is None else self.parent.layers()
+        layers.append(self)
+        return layers
+
+    def fingerprint(self) -> str:
+        """Hash of the data as a template sees it."""
+        if self._fingerprint is None:
+            own = fingerprint(self.data)
+            if self.parent is not None:
+                own = digest((self.parent.fingerprint() + own).encode())
+            self._fingerprint = own
+        return self._fingerprint
@@ -0,0 +1,186 @@
+"""Build daemon that keeps a project warm between builds.
+
+`liz daemon` runs in the foreground and listens on a Unix socket in the
+project's cache directory.  While it's running, `liz build` hands its
+options to the daemon and prints what the build printed, instead of
+starting a build of its own.  Between builds the daemon keeps:
+
+- the imported modules, so no interpreter or import start-up,
+- the parsed config and routes, until their files change,
+- Jinja environments and compiled templates, which Jinja reloads
+  when their source changes,
+- the content of `!file` and `!data-doc` files.
+
+Builds are run one at a time, each with the environment and working
+directory of the `liz build` that asked for it, so `!env` tags and
+`!sh` commands see the same variables as a build without the daemon.
+When no daemon is listening, `liz build` builds in its own process as
+usual; `--no-daemon` forces it to.
+"""
+import json
+import os
+import socket
+import sys
+import traceback
+
+from contextlib import contextmanager, redirect_stdout
+from typing import Any, Dict, List, Optional, Tuple
+
+from . import main as liz
+
+SOCKET = os.path.join(liz.cache_dir, 'daemon.sock')
+
+
+class _Output:
+    """Sends what a build prints to the client."""
+
+    def __init__(self, conn: socket.socket):
+        self.conn = conn
+
+    def write(self, text: str) -> int:
+        if text:
+            _send(self.conn, {'out': text})
+        return len(text)
+
+    def flush(self) -> None:
+        pass
+
+
+def _send(conn: socket.socket, message: Any) -> None:
+    conn.sendall(json.dumps(message).encode('utf8') + b'\n')
+
+
+def _messages(conn: socket.socket):
+    with conn.makefile('rb') as f:
+        for line in f:
+            yield json.loads(line)
+
+
+@contextmanager
+def _client(env: Optional[Dict[str, str]], cwd: Optional[str]):
+    """Take on the client's environment and directory for a build."""
+    environ = dict(os.environ)
+    previous = os.getcwd()
+    try:
+        if env is not None:
+            os.environ.clear()
+            os.environ.update(env)
+        if cwd:
+            os.chdir(cwd)
+        yield
+    finally:
+        os.chdir(previous)
+        os.environ.clear()
+        os.environ.update(environ)
+
+
+def _build(conn: socket.socket, opts: List[Tuple[str, str]],
+           args: List[str], env: Optional[Dict[str, str]] = None,
+           cwd: Optional[str] = None) -> int:
+    # State that one build must not leave behind for the next.
+    liz.IS_VERBOSE = False
+    out = _Output(conn)
+    with _client(env, cwd), redirect_stdout(out):
+        try:
+            liz.build(opts, args)
+        except SystemExit as e:
+            if e.code is None or isinstance(e.code, int):
+                return e.code or 0
+            print(e.code)
+            return 1
+        except Exception:
+            traceback.print_exc(file=out)
+            return 1
+    return 0
+
+
+def run() -> None:
+    """Serve builds until interrupted or asked to stop."""
+    from .render import keep_envs
+
+    liz._kept = {}
+    keep_envs()
+    if request_stop():
+        print("stopped the daemon that was running.")
+    os.makedirs(liz.cache_dir, exist_ok=True)
+    try:
+        os.remove(SOCKET)
+    except FileNotFoundError:
+        pass
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    server.bind(SOCKET)
+    server.listen()
+    print("daemon listening on " + SOCKET)
+    try:
+        while True:
+            conn, _ = server.accept()
+            with conn:
+                try:
+                    message = next(_messages(conn), None)
+                    if not message:
+                        continue
+                    if message.get('stop'):
+                        _send(conn, {'status': 0})
+                        break
+                    opts = [tuple(opt) for opt in message.get('opts', [])]
+                    status = _build(conn, opts, message.get('args', []),
+                                    message.get('env'), message.get('cwd'))
+                    _send(conn, {'status': status})
+                    print("build %s: %s" % (
+                        ' '.join(message.get('args', [])) or '-',
+                        'ok' if status == 0 else 'failed'),
+                          file=sys.stderr)
+                except (BrokenPipeError, ConnectionResetError):
+                    pass
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.close()
+        os.remove(SOCKET)
+
+
+def _connect() -> Optional[socket.socket]:
+    if not os.path.exists(SOCKET):
+        return None
+    conn = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        conn.connect(SOCKET)
+    except OSError:
+        # Left behind by a daemon that didn't exit cleanly.
+        conn.close()
+        return None
+    return conn
+
+
+def request_build(opts: List[Tuple[str, str]],
+                  args: List[str]) -> Optional[int]:
+    """Build in the daemon, returning its exit status.
+
+    Returns None when no daemon is listening.
+    """
+    conn = _connect()
+    if conn is None:
+        return None
+    with conn:
+        _send(conn, {'opts': opts, 'args': args,
+                     'env': dict(os.environ), 'cwd': os.getcwd()})
+        for message in _messages(conn):
+            if 'out' in message:
+                sys.stdout.write(message['out'])
+            elif 'status' in message:
+                sys.stdout.flush()
+                return message['status']
+    print("fatal: the daemon stopped during the build.")
+    return 1
+
+
+def request_stop() -> bool:
+    """Ask a running daemon to exit; False if none was running."""
+    conn = _connect()
+    if conn is None:
+        return False
+    with conn:
+        _send(conn, {'stop': True})
+        for _ in _messages(conn):
+            break
+    return True
@@ -0,0 +1,430 @@
+"""Loading liz's data files and the YAML tags they can use.
+
+    !env NAME  The value of an environment variable
+    !sh command  The output of a command, run in the background
+    !file path  The content of a file, read when first used
+    !data-doc path  YAML data followed by a `===` and a document
+
+Importing this module imports PyYAML, so the CLI only imports it from
+the commands that read data files.
+"""
+import json
+import os
+
+from typing import Optional, Any, Dict
+
+import yaml
+
+from .main import _fatal, cache_dir
+from .output import atomic_write
+
+# Use libyaml's loader when PyYAML was built with it.
+YAMLLoader = getattr(yaml, 'CFullLoader', yaml.FullLoader)
+_yaml_loaders = [yaml.Loader, yaml.FullLoader, yaml.UnsafeLoader, YAMLLoader]
+
+class EnvYAMLTag(yaml.YAMLObject):
+    yaml_loader = _yaml_loaders
+    yaml_tag = u'!env'
+    def __init__(self, env_var):
+        value = os.environ.get(env_var)
+        self.value = value
+
+    def __repr__(self):
+        return self.value
+
+    @classmethod
+    def from_yaml(cls, loader, node):
+        return EnvYAMLTag(node.value)
+
+    @classmethod
+    def to_yaml(cls, dumper, data):
+        return dumper.represent_scalar(cls.yaml_tag, data.value)
+
+
+# Shell commands run in the background while the rest of the YAML is
+# loaded; identical commands, with the same options, only run once
+# per load of the config. `load_config()` clears them.
+sh_timeout = 60
+_sh_pool = None
+_sh_results = {}
+
+def _sh_cache_fn(cmd_unsafe):
+    import hashlib
+    key = hashlib.sha1(cmd_unsafe.encode('utf8')).hexdigest()
+    return os.path.join(cache_dir, 'sh', key + '.pickle')
+
+def _mtime(filename):
+    try:
+        return os.path.getmtime(filename)
+    except OSError:
+        return None
+
+def _run_sh(cmd_unsafe, ttl=None, invalidate=None, timeout=None):
+    import pickle
+    import shlex
+    import subprocess
+    import time
+
+    # Output is only kept across builds when the tag says how long
+    # it stays valid.
+    cache_fn = _sh_cache_fn(cmd_unsafe)
+    cached = ttl is not None or invalidate is not None
+    if cached:
+        try:
+            with open(cache_fn, 'rb') as f:
+                entry = pickle.load(f)
+            fresh = ttl is None or time.time() - entry['time'] < ttl
+            if invalidate is not None:
+                fresh = fresh and entry['invalidate'] == _mtime(invalidate)
+            if fresh:
+                return entry['stdout']
+        except (OSError, EOFError, KeyError, pickle.UnpicklingError):
+            pass
+
+    cmd = shlex.split(cmd_unsafe)
+    try:
+        output = subprocess.run(cmd, capture_output=True,
+                                timeout=timeout or sh_timeout)
+    except subprocess.TimeoutExpired:
+        _fatal("'!sh %s' timed out after %ss." % (
+            cmd_unsafe, timeout or sh_timeout))
+    if cached:
+        os.makedirs(os.path.dirname(cache_fn), exist_ok=True)
+        atomic_write(cache_fn, pickle.dumps({
+            'time': time.time(),
+            'invalidate': invalidate and _mtime(invalidate),
+            'stdout': output.stdout,
+        }))
+    return output.stdout
+
+def _start_sh(cmd_unsafe, ttl=None, invalidate=None, timeout=None):
+    global _sh_pool
+    key = (cmd_unsafe, ttl, invalidate, timeout)
+    if key not in _sh_results:
+        if _sh_pool is None:
+            from concurrent.futures import ThreadPoolExecutor
+            _sh_pool = ThreadPoolExecutor(16)
+        _sh_results[key] = _sh_pool.submit(
+            _run_sh, cmd_unsafe, ttl, invalidate, timeout)
+    return _sh_results[key]
+
+
+class ShellYAMLTag(yaml.YAMLObject):
+    """Output of a shell command.
+
+    Takes either the command itself or a mapping with `cmd` and,
+    optionally, `timeout` in seconds plus `ttl` in seconds and/or
+    an `invalidate` file that allow the output to be reused by
+    later builds until it expires or the file changes:
+
+        version: !sh
+          cmd: git rev-parse HEAD
+          invalidate: .git/HEAD
+    """
+    yaml_loader = _yaml_loaders
+    yaml_tag = u'!sh'
+    def __init__(self, cmd_unsafe, ttl=None, invalidate=None, timeout=None):
+        self.cmd = cmd_unsafe
+        self._value = None
+        self._future = _start_sh(cmd_unsafe, ttl, invalidate, timeout)
+
+    @property
+    def value(self):
+        if self._future is not None:
+            self._value = self._future.result()
+            self._future = None
+        return self._value
+
+    def __getstate__(self):
+        return {'cmd': self.cmd, '_value': self.value, '_future': None}
+
+    def __repr__(self):
+        return self.value.decode('utf-8')
+
+    @classmethod
+    def from_yaml(cls, loader, node):
+        if isinstance(node, yaml.MappingNode):
+            opts = loader.construct_mapping(node)
+            return ShellYAMLTag(opts['cmd'], opts.get('ttl'),
+                                opts.get('invalidate'), opts.get('timeout'))
+        return ShellYAMLTag(node.value)
+
+    @classmethod
+    def to_yaml(cls, dumper, data):
+        return dumper.represent_scalar(cls.yaml_tag, data.value)
+
+
+# Files loaded by `!file` and `!data-doc` tags. Every tag pointing at
+# the same file shares one entry, which is kept until the file's mtime
+# changes.
+_file_cache = {}
+
+def _cached_file(filename, parse=None):
+    mtime = os.stat(filename).st_mtime_ns
+    cached = _file_cache.get((filename, parse))
+    if cached and cached[0] == mtime:
+        return cached[1]
+    with open(filename) as f:
+        value = f.read()
+    if parse:
+        value = parse(value)
+    _file_cache[(filename, parse)] = (mtime, value)
+    return value
+
+
+class FileYAMLTag(yaml.YAMLObject):
+    """Content of a file, read the first time it's used."""
+    yaml_loader = _yaml_loaders
+    yaml_tag = u'!file'
+    def __init__(self, filename):
+        self.filename = filename
+        self._value = None
+
+    @property
+    def value(self):
+        if self._value is None:
+            self._value = _cached_file(self.filename)
+        return self._value
+
+    def __getstate__(self):
+        # Worker processes read the file themselves, if they need it.
+        return {'filename': self.filename, '_value': None}
+
+    def __repr__(self):
+        return self.value
+
+    @classmethod
+    def from_yaml(cls, loader, node):
+        return FileYAMLTag(node.value)
+
+    @classmethod
+    def to_yaml(cls, dumper, data):
+        return dumper.represent_scalar(cls.yaml_tag, data.filename)
+
+
+def _parse_data_doc(content):
+    data, _, doc = content.partition('===')
+    value = yaml.load(data, Loader=YAMLLoader) or {}
+    value['doc'] = doc
+    return value
+
+
+class YAMLDocTag(yaml.YAMLObject):
+    """
+    Shapes structured and unstructured data into YAML object:
+
+        title: Hello
+        ===
+        Everything after the separator ends up in `doc`.
+
+    The file is read and parsed the first time it's used, and the
+    tag can then be used like a dict: `{{ post.title }}`.
+    """
+    yaml_loader = _yaml_loaders
+    yaml_tag = u'!data-doc'
+    def __init__(self, filename):
+        self.filename = filename
+        self._value = None
+
+    @property
+    def value(self):
+        if self._value is None:
+            self._value = _cached_file(self.filename, _parse_data_doc)
+        return self._value
+
+    def __getstate__(self):
+        return {'filename': self.filename, '_value': None}
+
+    def __getitem__(self, key):
+        return self.value[key]
+
+    def __contains__(self, key):
+        return key in self.value
+
+    def __iter__(self):
+        return iter(self.value)
+
+    def __len__(self):
+        return len(self.value)
+
+    def get(self, key, default=None):
+        return self.value.get(key, default)
+
+    def keys(self):
+        return self.value.keys()
+
+    def values(self):
+        return self.value.values()
+
+    def items(self):
+        return self.value.items()
+
+    def __repr__(self):
+        return repr(self.value)
+
+    @classmethod
+    def from_yaml(cls, loader, node):
+        return YAMLDocTag(node.value)
+
+    @classmethod
+    def to_yaml(cls, dumper, data):
+        return dumper.represent_scalar(cls.yaml_tag, data.value)
+
+
+def load_file(filename: str, filetype: Optional[str] = None) -> Dict[Any, Any]:
+    data = None
+    if not filetype:
+        filetype = _filetype(filename)
+    if filetype == 'jsonl':
+        return list(RouteStream(filename, filetype))
+    with open(filename, 'r') as f:
+        content = f.read()
+        if filetype == 'json':
+            data = json.loads(content)
+        elif filetype == 'yaml':
+            data = load_yaml(content)
+    return data
+
+# YAML documents at least this large are cached once parsed.
+yaml_cache_min = 4096
+
+def _has_tags(obj: Any) -> bool:
+    if isinstance(obj, yaml.YAMLObject):
+        return True
+    if isinstance(obj, dict):
+        return any(_has_tags(v) for v in obj.values())
+    if isinstance(obj, list):
+        return any(_has_tags(v) for v in obj)
+    return False
+
+def load_yaml(content: str) -> Any:
+    """Parse a YAML document, reusing earlier results where possible.
+
+    Parsed documents are pickled into the cache keyed by a hash
+    of their content. Documents using tags like `!sh` or `!file`
+    depend on more than their content and are always parsed.
+    """
+    import hashlib
+    import pickle
+
+    if len(content) < yaml_cache_min:
+        return yaml.load(content, Loader=YAMLLoader)
+    key = hashlib.sha1(content.encode('utf8')).hexdigest()
+    cache_fn = os.path.join(cache_dir, 'yaml', key + '.pickle')
+    try:
+        with open(cache_fn, 'rb') as f:
+            return pickle.load(f)
+    except (OSError, EOFError, pickle.UnpicklingError):
+        pass
+    data = yaml.load(content, Loader=YAMLLoader)
+    if not _has_tags(data):
+        os.makedirs(os.path.dirname(cache_fn), exist_ok=True)
+        atomic_write(cache_fn, pickle.dumps(data, pickle.HIGHEST_PROTOCOL))
+    return data
+
+def _filetype(filename: str) -> Optional[str]:
+    if filename.endswith('jsonl'):
+        return "jsonl"
+    elif filename.endswith('json'):
+        return "json"
+    elif filename.endswith('yml') or filename.endswith('yaml'):
+        return "yaml"
+    return None
+
+class _StreamLoader(YAMLLoader, yaml.composer.Composer):
+    """Composes a YAML document one node at a time, so the items of
+    a list can be loaded one by one."""
+    def __init__(self, stream):
+        super().__init__(stream)
+        self.anchors = {}
+
+
+# How much of a JSON array is read at a time.
+JSON_CHUNK = 64 * 1024
+
+class RouteStream:
+    """Routes read one at a time from a routes file.
+
+    JSON files are read either as JSON Lines, one route per line, or
+    as one array of routes, and YAML files as a list of routes or a
+    sequence of documents, one route (or list of routes) per
+    document. Each iteration reads the file again, so the routes
+    never have to be held in memory all at once.
+    """
+    def __init__(self, filename: str, filetype: Optional[str] = None):
+        self.filename = filename
+        self.filetype = filetype or _filetype(filename)
+
+    def __iter__(self):
+        with open(self.filename, 'r') as f:
+            try:
+                if self.filetype == 'yaml':
+                    routes = self._yaml(f)
+                else:
+                    routes = self._json(f)
+                for i, route in enumerate(routes):
+                    if not isinstance(route, dict):
+                        _fatal("route %d in '%s' isn't a mapping." %
+                               (i + 1, self.filename))
+                    yield route
+            except (ValueError, yaml.YAMLError) as e:
+                _fatal("couldn't read routes from '%s': %s" %
+                       (self.filename, e))
+
+    def _yaml(self, f):
+        loader = _StreamLoader(f)
+        try:
+            loader.get_event()
+            while not loader.check_event(yaml.StreamEndEvent):
+                loader.get_event()
+                if loader.check_event(yaml.SequenceStartEvent):
+                    # A list of routes is composed one route at a time.
+                    loader.get_event()
+                    while not loader.check_event(yaml.SequenceEndEvent):
+                        node = loader.compose_node(None, None)
+                        yield loader.construct_document(node)
+                    loader.get_event()
+                else:
+                    route = loader.construct_document(
+                        loader.compose_node(None, None))
+                    if route is not None:
+                        yield route
+                loader.get_event()
+                loader.anchors = {}
+        finally:
+            loader.dispose()
+
+    def _json(self, f):
+        start = f.read(JSON_CHUNK)
+        data = start.lstrip()
+        if not data.startswith('['):
+            f.seek(0)
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+            return
+        decoder = json.JSONDecoder()
+        data = data[1:]
+        pos = 0
+        while True:
+            while pos < len(data) and data[pos] in ' \t\r\n,':
+                pos += 1
+            if pos == len(data):
+                more = f.read(JSON_CHUNK)
+                if not more:
+                    raise ValueError("the array of routes isn't closed")
+                data, pos = more, 0
+                continue
+            if data[pos] == ']':
+                return
+            try:
+                route, end = decoder.raw_decode(data, pos)
+            except ValueError:
+                # The route continues past what's been read so far.
+                more = f.read(JSON_CHUNK)
+                if not more:
+                    raise
+                data, pos = data[pos:] + more, 0
+                continue
+            yield route
+            pos = end
@@ -0,0 +1,242 @@
+"""Deploy the build directory to a remote target.
+
+Every deploy stores a manifest of content hashes next to the files it
+uploads.  The next deploy compares the build directory against that
+manifest, uploads only the files that changed through a pool of
+concurrent uploads and then deletes files that no longer exist
+locally.  Files aren't listed or downloaded from the target.
+
+Targets are picked by URL scheme from `backends`:
+
+    /var/www/site, file:///var/www/site  A local directory
+    s3://bucket/prefix  An S3 bucket (needs boto3)
+
+S3 targets take an `endpoint` to use any S3-compatible service, e.g. a
+local MinIO or moto server for testing.
+
+Backends raise `RuntimeError` for anything that goes wrong on the
+target, which `liz deploy` reports without a traceback.
+"""
+import json
+import mimetypes
+import os
+import shutil
+
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import urlsplit
+
+from .compress import COMPRESSIBLE
+from .manifest import digest
+from .output import atomic_write
+
+MANIFEST_KEY = '.liz-manifest.json'
+
+# Hashes of local files, keyed by path, reused while their mtime and
+# size stay the same.
+HASH_CACHE = 'deploy-hashes.json'
+
+
+@contextmanager
+def _errors(errors: Tuple, action: str, target: str):
+    try:
+        yield
+    except errors as e:
+        raise RuntimeError("couldn't %s '%s': %s" % (action, target, e))
+
+
+class DirectoryBackend:
+    """Deploys to a directory on this machine, e.g. a mounted volume."""
+
+    def __init__(self, url: str, options: Dict):
+        parts = urlsplit(url)
+        self.root = parts.path if parts.scheme == 'file' else url
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.root, *key.split('/'))
+
+    def get_manifest(self) -> Dict[str, str]:
+        try:
+            with open(self._path(MANIFEST_KEY), 'r') as f:
+                return json.load(f).get('files', {})
+        except (OSError, ValueError):
+            return {}
+
+    def put_manifest(self, files: Dict[str, str]) -> None:
+        with _errors(OSError, 'write', self._path(MANIFEST_KEY)):
+            os.makedirs(self.root, exist_ok=True)
+            atomic_write(self._path(MANIFEST_KEY),
+                         json.dumps({'version': 1, 'files': files}))
+
+    def put(self, key: str, filename: str) -> None:
+        path = self._path(key)
+        with _errors(OSError, 'copy to', path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp = path + '.liz-tmp'
+            shutil.copyfile(filename, tmp)
+            os.replace(tmp, path)
+
+    def delete(self, keys: List[str]) -> None:
+        for key in keys:
+            with _errors(OSError, 'delete', self._path(key)):
+                try:
+                    os.remove(self._path(key))
+                except FileNotFoundError:
+                    pass
+
+
+class S3Backend:
+    """Deploys to an S3 bucket or any service speaking the S3 API."""
+
+    def __init__(self, url: str, options: Dict):
+        try:
+            import boto3
+            from boto3.exceptions import Boto3Error
+            from botocore.exceptions import BotoCoreError, ClientError
+        except ImportError:
+            raise RuntimeError("deploying to S3 needs boto3 installed.")
+        parts = urlsplit(url)
+        self.bucket = parts.netloc
+        self.prefix = parts.path.strip('/')
+        self.cache_control = options.get('cache-control')
+        # E.g. missing credentials, an endpoint that can't be reached,
+        # access denied or a failed upload.
+        self.errors = (Boto3Error, BotoCoreError, ClientError, OSError)
+        with _errors(self.errors, 'connect to', url):
+            self.client = boto3.client(
+                's3', endpoint_url=options.get('endpoint'))
+
+    def _key(self, key: str) -> str:
+        return self.prefix + '/' + key if self.prefix else key
+
+    def _url(self, key: str) -> str:
+        return 's3://%s/%s' % (self.bucket, self._key(key))
+
+    def get_manifest(self) -> Dict[str, str]:
+        with _errors(self.errors, 'read', self._url(MANIFEST_KEY)):
+            try:
+                response = self.client.get_object(
+                    Bucket=self.bucket, Key=self._key(MANIFEST_KEY))
+            except self.client.exceptions.NoSuchKey:
+                return {}
+            body = response['Body'].read()
+        try:
+            return json.loads(body).get('files', {})
+        except ValueError:
+            return {}
+
+    def put_manifest(self, files: Dict[str, str]) -> None:
+        body = json.dumps({'version': 1, 'files': files}).encode('utf8')
+        with _errors(self.errors, 'write', self._url(MANIFEST_KEY)):
+            self.client.put_object(
+                Bucket=self.bucket, Key=self._key(MANIFEST_KEY),
+                Body=body, ContentType='application/json')
+
+    def put(self, key: str, filename: str) -> None:
+        content_type, encoding = mimetypes.guess_type(key)
+        extra = {'ContentType': content_type or 'application/octet-stream'}
+        if encoding and os.path.splitext(key)[0].endswith(COMPRESSIBLE):
+            # Variants written by `compress`, e.g. `index.html.gz` is
+            # gzipped `text/html`; archives like `.tar.gz` aren't.
+            extra['ContentEncoding'] = encoding
+        if self.cache_control:
+            extra['CacheControl'] = self.cache_control
+        with _errors(self.errors, 'upload to', self._url(key)):
+            self.client.upload_file(filename, self.bucket, self._key(key),
+                                    ExtraArgs=extra)
+
+    def delete(self, keys: List[str]) -> None:
+        # S3 deletes at most 1000 objects per request.
+        for i in range(0, len(keys), 1000):
+            objects = [{'Key': self._key(key)} for key in keys[i:i + 1000]]
+            with _errors(self.errors, 'delete from', self._url('')):
+                response = self.client.delete_objects(
+                    Bucket=self.bucket, Delete={'Objects': objects})
+            # Objects that couldn't be deleted don't fail the request.
+            failed = response.get('Errors')
+            if failed:
+                raise RuntimeError("couldn't delete 's3://%s/%s': %s" % (
+                    self.bucket, failed[0]['Key'], failed[0].get('Message')))
+
+
+backends = {
+    '': DirectoryBackend,
+    'file': DirectoryBackend,
+    's3': S3Backend,
+}
+
+
+def make_backend(url: str, options: Optional[Dict] = None):
+    scheme = urlsplit(url).scheme
+    if scheme not in backends:
+        raise RuntimeError("no deploy backend for '%s'." % url)
+    return backends[scheme](url, options or {})
+
+
+def local_manifest(build_dir: str, cache_fn: str) -> Dict[str, str]:
+    """Hash every file in `build_dir`, keyed by its path in the target."""
+    try:
+        with open(cache_fn, 'r') as f:
+            cache = json.load(f)
+    except (OSError, ValueError):
+        cache = {}
+    files = {}
+    stamps = {}
+    for dirpath, _, filenames in os.walk(build_dir):
+        for fn in filenames:
+            path = os.path.join(dirpath, fn)
+            key = os.path.relpath(path, build_dir).replace(os.sep, '/')
+            st = os.stat(path)
+            stamp = [st.st_mtime_ns, st.st_size]
+            cached = cache.get(key)
+            if cached and cached[:2] == stamp:
+                content_hash = cached[2]
+            else:
+                with open(path, 'rb') as f:
+                    content_hash = digest(f.read())
+            files[key] = content_hash
+            stamps[key] = stamp + [content_hash]
+    os.makedirs(os.path.dirname(cache_fn) or '.', exist_ok=True)
+    atomic_write(cache_fn, json.dumps(stamps))
+    return files
+
+
+def plan(local: Dict[str, str],
+         remote: Dict[str, str]) -> Tuple[List[str], List[str]]:
+    """Return the keys to upload and the keys to delete."""
+    upload = sorted(key for key, content_hash in local.items()
+                    if remote.get(key) != content_hash)
+    delete = sorted(key for key in remote if key not in local)
+    return upload, delete
+
+
+def deploy(backend, build_dir: str, cache_dir: str, jobs: int = 16,
+           dry_run: bool = False) -> Tuple[List[str], List[str]]:
+    local = local_manifest(build_dir, os.path.join(cache_dir, HASH_CACHE))
+    remote = backend.get_manifest()
+    upload, delete = plan(local, remote)
+    if dry_run:
+        return upload, delete
+
+    def put(key: str) -> str:
+        backend.put(key, os.path.join(build_dir, *key.split('/')))
+        return key
+
+    try:
+        with ThreadPoolExecutor(jobs) as pool:
+            for key in pool.map(put, upload):
+                remote[key] = local[key]
+    except BaseException:
+        # Record what did get uploaded, so the next deploy doesn't
+        # have to start over; the target may be failing too, though,
+        # and then the error reported is the upload's.
+        try:
+            backend.put_manifest(remote)
+        except RuntimeError:
+            pass
+        raise
+    if delete:
+        backend.delete(delete)
+    backend.put_manifest(local)
+    return upload, delete
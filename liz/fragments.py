@@ -0,0 +1,143 @@
+"""Fragments of templates rendered once and reused across routes.
+
+Wrapping part of a template in a `cache` tag renders it once per key
+rather than once per route:
+
+    {% cache 'nav', section %}
+      {% for page in pages %}...{% endfor %}
+    {% endcache %}
+
+The keys must cover whatever the fragment uses besides the global
+`data` and template globals.  Fragments are also keyed by the source
+of the template they're in, and `liz build` salts every key with the
+global data, the template globals and the source of every template, so
+changing any of them renders fragments again.
+
+Rendered fragments are kept in memory for the rest of a build and in
+the cache directory for later builds.  After each build the oldest
+fragments on disk are removed until they fit in `max-size` bytes:
+
+    fragments:
+      max-size: 67108864
+
+Outside of `liz build`, like in `liz serve`, fragments are rendered
+every time.
+"""
+import os
+
+from typing import Any, Dict, List, Optional
+
+from jinja2 import nodes
+from jinja2.ext import Extension
+from markupsafe import Markup
+
+from .manifest import digest, fingerprint
+from .output import atomic_write
+
+MAX_SIZE = 64 * 1024 * 1024
+
+
+class FragmentCache:
+    """Rendered fragments in memory, backed by files in `directory`."""
+
+    def __init__(self, salt: str, directory: Optional[str] = None):
+        self.salt = salt
+        self.directory = directory
+        self.memory = {}  # type: Dict[str, str]
+
+    def __getstate__(self):
+        # Workers start with an empty memory of their own.
+        return {'salt': self.salt, 'directory': self.directory,
+                'memory': {}}
+
+    def key(self, parts: List[Any]) -> str:
+        return fingerprint([self.salt, parts])
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, key[:2], key + '.html')
+
+    def get(self, key: str) -> Optional[str]:
+        if key in self.memory:
+            return self.memory[key]
+        if not self.directory:
+            return None
+        path = self._path(key)
+        try:
+            with open(path, 'r', encoding='utf8') as f:
+                value = f.read()
+            # Marks it as recently used for `prune()`.
+            os.utime(path)
+        except OSError:
+            return None
+        self.memory[key] = value
+        return value
+
+    def set(self, key: str, value: str) -> None:
+        self.memory[key] = value
+        if not self.directory:
+            return
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        atomic_write(path, value)
+
+
+def prune(directory: str, max_size: int = MAX_SIZE) -> int:
+    """Remove the least recently used fragments over `max_size` bytes."""
+    files = []
+    total = 0
+    for dirpath, _, filenames in os.walk(directory):
+        for fn in filenames:
+            path = os.path.join(dirpath, fn)
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            files.append((st.st_mtime_ns, st.st_size, path))
+            total += st.st_size
+    removed = 0
+    for _, size, path in sorted(files):
+        if total <= max_size:
+            break
+        try:
+            os.remove(path)
+        except OSError:
+            continue
+        total -= size
+        removed += 1
+    return removed
+
+
+class FragmentCacheExtension(Extension):
+    """Adds `{% cache key, ... %}...{% endcache %}` to templates."""
+    tags = {'cache'}
+
+    def __init__(self, environment):
+        super().__init__(environment)
+        environment.extend(fragment_cache=None)
+
+    def parse(self, parser):
+        lineno = next(parser.stream).lineno
+        keys = [parser.parse_expression()]
+        while parser.stream.skip_if('comma'):
+            keys.append(parser.parse_expression())
+        body = parser.parse_statements(('name:endcache',), drop_needle=True)
+        source = ''
+        if parser.name and self.environment.loader:
+            source, _, _ = self.environment.loader.get_source(
+                self.environment, parser.name)
+        args = [nodes.Const(digest(source.encode('utf8'))),
+                nodes.Const(lineno), nodes.List(keys)]
+        return nodes.CallBlock(self.call_method('_render', args),
+                               [], [], body).set_lineno(lineno)
+
+    def _render(self, source_hash: str, lineno: int, keys: List[Any],
+                caller) -> str:
+        cache = self.environment.fragment_cache
+        if cache is None:
+            return caller()
+        key = cache.key([source_hash, lineno, keys])
+        value = cache.get(key)
+        if value is None:
+            value = str(caller())
+            cache.set(key, value)
+        return Markup(value)
@@ -4,107 +4,41 @@
 commands:
     init <name>  Creates a standard web project
     build  Generates templates according to liz config
+    compile  Compiles templates into the cache ahead of a build
+    serve  Serves the project and rebuilds it as files change
+    deploy [<target>]  Uploads files in the build directory that changed
+    daemon  Keeps the project loaded so builds start instantly
 
 options:
     -h  Print this message
     -v  Print project info when building
 
-docs: https://github.com/stakodiak/liz
-"""
-import json
-import os
-import getopt
-import sys
+build options:
+    -s, --path-suffix <suffix>  Append suffix to route paths
+    -i, --incremental  Only render routes whose inputs changed
+    -j, --jobs <n>  Render routes in <n> worker processes
+    --stream  Read the routes file one route at a time
+    --profile <file>  Time each build phase and route, write JSON report
+    -n, --dry-run  List the outputs that would change without writing them
+    --no-daemon  Build in this process even if `liz daemon` is running
 
-from typing import Optional, Any, Dict
+serve options:
+    -p, --port <port>  Port to listen on (default 10101)
 
-import yaml
+deploy options:
+    -j, --jobs <n>  Upload <n> files at a time (default 16)
+    -n, --dry-run  List what would be uploaded and deleted
 
+daemon options:
+    --stop  Stop the running daemon
 
+docs: https://github.com/stakodiak/liz
+"""
 import os
-import yaml
-
-class EnvYAMLTag(yaml.YAMLObject):
-    yaml_tag = u'!env'
-    def __init__(self, env_var):
-        value = os.environ.get(env_var)
-        self.value = value
-
-    def __repr__(self):
-        return self.value
-
-    @classmethod
-    def from_yaml(cls, loader, node):
-        return EnvYAMLTag(node.value)
-
-    @classmethod
-    def to_yaml(cls, dumper, data):
-        return dumper.represent_scalar(cls.yaml_tag, data.value)
-
-
-class ShellYAMLTag(yaml.YAMLObject):
-    yaml_tag = u'!sh'
-    def __init__(self, cmd_unsafe):
-        import subprocess
-        import shlex
-        cmd = shlex.split(cmd_unsafe)
-        output = subprocess.run(cmd, capture_output=True)
-        self.value = output.stdout
-
-    def __repr__(self):
-        return self.value.decode('utf-8')
-
-    @classmethod
-    def from_yaml(cls, loader, node):
-        return ShellYAMLTag(node.value)
-
-    @classmethod
-    def to_yaml(cls, dumper, data):
-        return dumper.represent_scalar(cls.yaml_tag, data.value)
-
-
-class FileYAMLTag(yaml.YAMLObject):
-    yaml_tag = u'!file'
-    def __init__(self, filename):
-        content = open(filename).read()
-        self.value = content
-
-    def __repr__(self):
-        return self.value
-
-    @classmethod
-    def from_yaml(cls, loader, node):
-        return FileYAMLTag(node.value)
-
-    @classmethod
-    def to_yaml(cls, dumper, data):
-        return dumper.represent_scalar(cls.yaml_tag, data.value)
-
-
-class YAMLDocTag(yaml.YAMLObject):
-    """
-    Shapes structured and unstructured data into YAML object:
-    
-    """
-    yaml_tag = u'!data-doc'
-    def __init__(self, filename):
-        content = open(filename).read()
-        data, doc = (lambda args: args[0], ''.join(args[1:]))(content.split('==='))
-        self.value = yaml.load(data)
-        self.value['doc'] = doc
-
-    def __repr__(self):
-        return self.value
-
-    @classmethod
-    def from_yaml(cls, loader, node):
-        return FileYAMLTag(node.value)
-
-    @classmethod
-    def to_yaml(cls, dumper, data):
-        return dumper.represent_scalar(cls.yaml_tag, data.value)
-
+import getopt
+import sys
 
+from typing import Optional, Any, Dict, Iterable, List
 
 SAMPLE_STYLES_SCSS = """
 /* resets */
@@ -148,7 +82,7 @@ clean:
 port = 10101
 run:
 	open -a 'Google Chrome' "http://localhost:$(port)"
-	python3 -m http.server $(port)
+	liz serve -p $(port)
 """
 
 SAMPLE_BASE_TEMPLATE = """
@@ -175,6 +109,13 @@ SAMPLE_HOME_TEMPLATE = """
 
 config_fn = 'liz.yml'
 
+# Build manifests and other caches live here.
+cache_dir = '.liz-cache'
+manifest_fn = os.path.join(cache_dir, 'manifest.json')
+bytecode_dir = os.path.join(cache_dir, 'templates')
+fragments_dir = os.path.join(cache_dir, 'fragments')
+minified_dir = os.path.join(cache_dir, 'minified')
+
 SAMPLE_CONFIG = """
 templates: templates
 build: build/
@@ -185,7 +126,7 @@ routes:
       dish: sticks
 """
 
-IS_VERBOSE = True
+IS_VERBOSE = False
 
 def _pprint(data):
     import json
@@ -245,20 +186,208 @@ def init(opts, args):
     with open(os.path.join(templates_dir, sample_home_template), 'w') as f:
         f.write(SAMPLE_HOME_TEMPLATE)
 
-def load_file(filename: str, filetype: Optional[str] = None) -> Dict[Any, Any]:
-    data = None
-    if not filetype:
-        if filename.endswith('json'):
-            filetype = "json"
-        elif filename.endswith('yml') or filename.endswith('yaml'):
-            filetype = "yaml"
-    with open(filename, 'r') as f:
-        content = f.read()
-        if filetype == 'json':
-            data = json.loads(content)
-        elif filetype == 'yaml':
-            data = yaml.load(content)
-    return data
+# Parsed files kept from build to build by `liz daemon`, keyed by
+# what they are and checked against the files' mtime and size. Files
+# with YAML tags aren't kept, so tags like `!sh` and `!env` are
+# evaluated again on every build.
+_kept = None  # type: Optional[Dict[str, Any]]
+
+def _keep(key: str, filename: str, load):
+    from .data import _has_tags
+
+    if _kept is None:
+        return load()
+    st = os.stat(filename)
+    stamp = (filename, st.st_mtime_ns, st.st_size)
+    cached = _kept.get(key)
+    if cached and cached[0] == stamp:
+        return cached[1]
+    value = load()
+    if not _has_tags(value):
+        _kept[key] = (stamp, value)
+    return value
+
+def load_config() -> Dict[Any, Any]:
+    # Make sure we're in a liz project and it's properly configured.
+    if not os.path.exists(config_fn):
+        print("fatal: not a liz project.")
+        sys.exit(1)
+
+    from .data import _sh_results, load_file
+
+    # `!sh` commands run again for every load, so long-running
+    # processes like `liz serve` don't keep their first output.
+    _sh_results.clear()
+    # TODO Convert liz.config to yaml format
+    config = _keep('config', config_fn, lambda: load_file(config_fn, "yaml"))
+    if not config:
+        _fatal("couldn't parse project config.")
+    return config
+
+def load_routes(config: Dict[Any, Any]) -> Iterable[Dict[Any, Any]]:
+    """Load the routes listed in the config or in the file it names.
+
+    JSON Lines routes files, and any routes file when the config
+    sets `stream`, are streamed rather than loaded up front. A
+    directory or glob loads routes from every file it matches.
+    """
+    routes_fn = config.get('routes')
+    if type(routes_fn) is str:
+        from .data import RouteStream, _filetype, load_file
+        from .shards import is_sharded, load_shards
+        if is_sharded(routes_fn):
+            return load_shards(routes_fn)
+        if config.get('stream') or _filetype(routes_fn) == 'jsonl':
+            return RouteStream(routes_fn)
+        return _keep('routes', routes_fn, lambda: load_file(routes_fn))
+    return routes_fn
+
+def get_path(config: Dict[Any, Any], route: Dict[Any, Any]) -> str:
+    if 'page' in route:
+        path = route.get('page')
+    else:
+        path = route.get('path') or route.get('name')
+    if 'path-suffix' in config:
+        suffix = config['path-suffix']
+        if path.startswith('/'):
+            path = path[1:]
+        if not path.endswith(suffix) and not '://' in path:
+            path += suffix
+        if path.endswith("index.html"):
+            path = path[:-len('index.html')]
+    return path
+
+class Route:
+    """A route with its output path and URL worked out."""
+    __slots__ = ('name', 'path', 'url', 'template', 'data')
+
+    def __init__(self, name: Optional[str], path: str, url: str,
+                 template: Optional[str], data: Dict[Any, Any]):
+        self.name = name
+        self.path = path
+        self.url = url
+        self.template = template
+        self.data = data
+
+def compile_routes(config: Dict[Any, Any], routes, build_dir: str = ''):
+    """Yield a `Route` for every route, expanding collection routes.
+
+    Routes are named by their `name` (or `page`), or else by their
+    path.
+    """
+    from .collection import expand_routes
+
+    for route in expand_routes(routes):
+        if not (route.get('page') or route.get('path') or route.get('name')):
+            _fatal("routes '%s' not in '%s'." % (route, config.get('routes')))
+        path = get_path(config, route)
+        name = route.get('name') or route.get('page') or route.get('path')
+        url = path if '://' in path else '/' + path
+        yield Route(name, os.path.join(build_dir, path), url,
+                    route.get('template'), route.get('data') or {})
+
+class RouteTable:
+    """Compiled routes and the URL map built from them.
+
+    Routes held in memory are compiled once and kept; streamed
+    routes, and those with collections, are compiled again on each
+    pass so they never have to be held all at once.
+    """
+    def __init__(self, config: Dict[Any, Any], routes, build_dir: str):
+        self.config = config
+        self.routes = routes
+        self.build_dir = build_dir
+        self.urls = {}  # type: Dict[str, str]
+        self.templates = set()
+        keep = isinstance(routes, list) and not any(
+            'collection' in route for route in routes)
+        records = []
+        for route in compile_routes(config, routes, build_dir):
+            self.urls[route.name] = route.url
+            if route.template:
+                self.templates.add(route.template)
+            if keep:
+                records.append(route)
+        self.records = records if keep else None
+
+    def __iter__(self):
+        if self.records is not None:
+            return iter(self.records)
+        return compile_routes(self.config, self.routes, self.build_dir)
+
+def iter_routes(config: Dict[Any, Any], routes, build_dir: str):
+    """Yield `(path, template, data)` for every route with a template.
+
+    Each route's data is layered over the global `data`, so routes
+    see the global data and their own, but never each other's.
+    `routes` may be a `RouteTable` to reuse its compiled routes.
+    """
+    from .context import Layer
+
+    if not isinstance(routes, RouteTable):
+        routes = compile_routes(config, routes, build_dir)
+    global_data = Layer(config.get("data") or {})
+    for route in routes:
+        # Some routes are for external routing.
+        if not route.template:
+            continue
+        data = Layer(route.data, global_data)
+        if IS_VERBOSE and route.data:
+            _pprint(dict(data))
+        yield route.path, route.template, data
+
+def get_template_globals(config: Dict[Any, Any], build_dir: str,
+                         dry_run: bool = False, profile=None) -> Dict:
+    """Globals from the config, the global `data`, plus `asset()` if
+    assets are set up."""
+    from contextlib import nullcontext
+    from .context import Layer
+
+    template_globals = dict(config.get("config") or {})
+    # Macros imported from other templates only see globals, so they
+    # get the global data; routes see theirs layered over it.
+    template_globals['data'] = Layer(config.get("data") or {})
+    # Assets are built before rendering so templates can link to
+    # their fingerprinted names.
+    assets_dir = config.get('assets')
+    if assets_dir:
+        from .assets import build_assets
+        with profile.phase('assets') if profile else nullcontext():
+            try:
+                template_globals['asset'] = build_assets(
+                    assets_dir, build_dir, cache_dir, dry_run)
+            except RuntimeError as e:
+                _fatal(str(e))
+    return template_globals
+
+def compile_templates(opts=None, args=None) -> None:
+    """Compile every template into the bytecode cache.
+
+    `build` loads templates through the same cache, so running
+    this ahead of time (e.g. while preparing a CI image) leaves
+    nothing for the build itself to compile. Cached bytecode is
+    keyed by a checksum of the template source, so editing a
+    template simply makes it miss the cache once.
+    """
+    from jinja2 import TemplateError
+    from .render import make_env
+
+    config = load_config()
+    if args:
+        _fatal("'compile' doesn't accept any arguments.")
+    templates_dir = config.get('templates') or "."
+    env = make_env(templates_dir, {}, bytecode_dir=bytecode_dir)
+    failed = 0
+    for name in env.list_templates():
+        try:
+            env.get_template(name)
+        except (TemplateError, UnicodeDecodeError) as e:
+            print("error: couldn't compile '%s': %s" % (name, e))
+            failed += 1
+    hits, misses = env.bytecode_cache.take()
+    print("templates: %d cached, %d compiled" % (hits, misses - failed))
+    if failed:
+        _fatal("%d template(s) failed to compile." % failed)
 
 def build(opts=None, args=None) -> None:
     """Build a liz project.
@@ -270,41 +399,67 @@ def build(opts=None, args=None) -> None:
     import json
     import os
     import sys
-    from jinja2 import Environment, FileSystemLoader
-
-    # Make sure we're in a liz project and it's properly configured.
-    if not os.path.exists(config_fn):
-        print("fatal: not a liz project.")
-        sys.exit(1)
-
-    # TODO Convert liz.config to yaml format
-    config = load_file(config_fn, "yaml")
-    if not config:
-        _fatal("couldn't parse project config.")
+    from jinja2 import TemplateError
+    from .context import Layer
+    from .data import RouteStream, _sh_results
+    from .fragments import MAX_SIZE, FragmentCache, prune
+    from .manifest import Manifest, fingerprint
+    from .output import Writer, save_state, stage, swap
+    from .profile import Profile
+    from .render import check_urls, make_env, render_routes
+    global IS_VERBOSE
 
     # Parse command arguments.
     try:
         nopts, nargs = getopt.getopt(args,
-            "vhs:", ["verbose', help", "path-suffix="])
+            "vhs:ij:n", ["verbose", "help", "path-suffix=", "incremental",
+                      "jobs=", "stream", "profile=", "dry-run",
+                      "no-daemon"])
         if nargs:
             _fatal("'build' doesn't accept any arguments.")
     except getopt.GetoptError:
         print(__doc__)
         sys.exit(1)
     options = sum([opts + nopts], [])
+    overrides = {}
+    incremental = False
+    jobs = 1
+    profile_fn = None
+    dry_run = False
     for opt, arg in options:
         if opt in ('-h', '--help'):
             print(__doc__)
             sys.exit()
         elif opt in ('-s', '--path-suffix'):
-            config['path-suffix'] = arg
+            overrides['path-suffix'] = arg
+        elif opt in ('-i', '--incremental'):
+            incremental = True
+        elif opt in ('-j', '--jobs'):
+            try:
+                jobs = int(arg)
+            except ValueError:
+                _fatal("'%s' is not a number of jobs." % arg)
+        elif opt == '--stream':
+            overrides['stream'] = True
+        elif opt == '--profile':
+            profile_fn = arg
+        elif opt in ('-n', '--dry-run'):
+            dry_run = True
         elif opt in ('-v', '--verbose'):
-            pass
-    print(options)
+            IS_VERBOSE = True
     if IS_VERBOSE:
         print('build config =>')
         print(options)
 
+    profile = Profile()
+    with profile.phase('config'):
+        config = dict(load_config())
+        config.update(overrides)
+    # Wait for the config's shell commands, which run in the background.
+    with profile.phase('sh'):
+        for result in list(_sh_results.values()):
+            result.result()
+
     # Look for Jinja templates in 'templates/'.
     if IS_VERBOSE:
         print('liz config =>')
@@ -312,98 +467,344 @@ def build(opts=None, args=None) -> None:
     templates_dir = config.get('templates')
     if not templates_dir:
         templates_dir = "."
-    env = Environment(loader=FileSystemLoader(templates_dir))
 
     # TODO This should be able to be specified by a
     # command-line argument.
     build_dir = config.get('build')
-    if not os.path.exists(build_dir):
-        os.makedirs(build_dir)
+    # Everything is written to a copy of the build directory that
+    # replaces it once the build succeeds.
+    output_dir = build_dir
+    if not dry_run:
+        with profile.phase('stage'):
+            output_dir = stage(build_dir)
 
     # Figure out which routes file to load from config.
-    routes_fn = config.get('routes')
-    routes = []
-    if type(routes_fn) is str:
-        routes_d = load_file(routes_fn)
-    else:
-        routes_d = routes_fn
+    with profile.phase('routes'):
+        routes = load_routes(config)
 
-    if IS_VERBOSE:
+    if IS_VERBOSE and not isinstance(routes, RouteStream):
         print("\nloaded routes =>")
-        _pprint(routes_d)
+        _pprint(routes)
 
     # Build list of routes.
-    urls = {}  # for finding routes in the template
-    env.globals['url'] = lambda name: urls[name]
-    global_data = config.get("data", {})
-    env.globals['data'] = global_data
-
-    template_globals = config.get("config")
-    if template_globals:
-        for k, v in template_globals.items():
-            env.globals[k] = v
-
-    def get_path(route):
-        if 'page' in route:
-            path = route.get('page')
-        else:
-            path = route.get('path') or route.get('name')
-        if 'path-suffix' in config:
-            suffix = config['path-suffix']
-            if path.startswith('/'):
-                path = path[1:]
-            if not path.endswith(suffix) and not '://' in path:
-                path += suffix
-            if path.endswith("index.html"):
-                path = path[:-len('index.html')]
-        return path
-    try:
-        # By default, the list of routes is an attribute
-        # called "routes".
-        routes = routes_d
-        for route in routes:
-            if 'name' in route or 'page' in route:
-                name = route.get('name') or route.get('page')
-                urls[name] = get_path(route)
-                is_absolute_url = '://' in get_path(route)
-                if not is_absolute_url:
-                    urls[name] = '/' + get_path(route)
-            elif 'path' in route:
-                urls[route['path']] = route['template']
-    except KeyError:
-        _fatal("routes '%s' not in '%s'." % (route, routes_fn))
+    with profile.phase('urls'):
+        # for finding routes in the template
+        table = RouteTable(config, routes, output_dir)
+        urls = table.urls
+    template_globals = get_template_globals(config, output_dir, dry_run,
+                                            profile)
+    env = make_env(templates_dir, urls, template_globals)
+
     if IS_VERBOSE:
         print("URLs =>")
         _pprint(urls)
 
+    # Anything that every route sees goes into the manifest's global
+    # fingerprint; when it changes, all routes are rendered again.
+    manifest = Manifest(manifest_fn, {
+        'urls': urls,
+        'config': template_globals,
+        'path-suffix': config.get('path-suffix'),
+        'minify': config.get('minify'),
+    }, output_dir)
+    assets = template_globals.get('asset') or {}
+    manifest.assets = sorted(url.lstrip('/') for url in assets.values())
+
+    def shown(path):
+        # Messages name outputs in the build directory, not the staging
+        # directory they're written to.
+        return os.path.join(build_dir, manifest.key(path))
+
+    # Check links to other routes before rendering anything, so a
+    # typo doesn't fail a long build halfway through.
+    with profile.phase('links'):
+        template_deps = manifest.all_template_deps(env, table.templates)
+        problems = check_urls(env, template_deps, urls)
+    if problems:
+        for problem in problems:
+            print("error: " + problem)
+        _fatal("%d link(s) to missing routes." % len(problems))
+
+    # `{% cache %}` fragments can be reused as long as nothing every
+    # route shares has changed.
+    global_data = Layer(config.get('data') or {})
+    fragments = FragmentCache(
+        fingerprint([manifest.globals, global_data.fingerprint(),
+                     manifest.file_deps(global_data), template_deps]),
+        None if dry_run else fragments_dir)
+
+    # Outputs are minified where they're rendered, see minify.py.
+    minifier = None
+    minify = config.get('minify')
+    if minify:
+        from .minify import Minifier
+        if not isinstance(minify, dict):
+            minify = {}
+        minifier = Minifier(minify, output_dir,
+                            None if dry_run else minified_dir)
+
     # Build project and render each route.
-    for route in routes:
-        template = route.get('template')
-        # Some routes are for external routing.
-        if not template:
-            continue
-        #
-        loader = env.get_template(template)
-        data = global_data
-        if route.get('data'):
-            data.update(**route.get('data'))
-            if IS_VERBOSE:
-                _pprint(data)
-        content = loader.render(data)
-
-        path = os.path.join(build_dir, get_path(route))
-        head, tail = os.path.split(path)
-        os.makedirs(head, exist_ok=True)
-        try:
-            with open(path, 'wb') as f:
-                content = content.encode('utf8')
-                f.write(content)
-        except IsADirectoryError:
-            with open(path + 'index.html', 'wb') as f:
-                content = content.encode('utf8')
-                f.write(content)
+    entries = {}
+    errors = []
+    def render_jobs():
+        for path, template, data in iter_routes(config, table, output_dir):
+            try:
+                entry = manifest.entry(env, template, data)
+            except TemplateError as e:
+                errors.append((shown(path),
+                               "%s: %s\n" % (type(e).__name__, e)))
+                continue
+            if incremental and manifest.reuse(path, entry):
+                continue
+            entries[path] = entry
+            # Workers have the global data already; only the route's
+            # own layer is sent to them.
+            yield (path, template, data.data, manifest.output_hash(path),
+                   dry_run)
+
+    hits = misses = 0
+    written = unchanged = 0
+    minified = {'minified': 0, 'cached': 0}
+    writer = Writer(timed=bool(profile_fn))
+    # Routes are profiled once their output is written.
+    profiled = []
+    with profile.phase('render'):
+        results = render_routes(render_jobs(), templates_dir, urls,
+                                template_globals, jobs, bytecode_dir,
+                                fragments, minifier)
+        for path, output, error, info, content in results:
+            hits += info['hits']
+            misses += info['misses']
+            if info['minified']:
+                minified[info['minified']] += 1
+            if error:
+                errors.append((shown(path), error))
+                continue
+            if content is not None:
+                writer.write(output, content)
+            manifest.add(path, entries[path], output, info['hash'])
+            if info['changed']:
+                written += 1
+                if dry_run:
+                    print("would write: " + output)
+            else:
+                unchanged += 1
+            if profile_fn:
+                profiled.append((shown(path), entries[path]['template'],
+                                 info['times'], output))
+    with profile.phase('write'):
+        failed = writer.close()
+    for path, template, times, output in profiled:
+        if output in writer.times:
+            times['write'] = writer.times[output]
+        profile.route(path, template, times)
+    if errors:
+        for path, error in errors:
+            print("error: couldn't render '%s':" % path)
+            print(error)
+        _fatal("%d route(s) failed to render." % len(errors))
+    if failed:
+        for output, error in failed:
+            print("error: couldn't write '%s': %s" % (shown(output), error))
+        _fatal("%d output(s) couldn't be written." % len(failed))
+    print("templates: %d cached, %d compiled" % (hits, misses))
+    print("outputs: %d %s, %d unchanged" % (
+        written, "to write" if dry_run else "written", unchanged))
+    if minifier:
+        print("minified: %d cached, %d minified" % (
+            minified['cached'], minified['minified']))
+
+    # Files written from the routes rather than rendered, see
+    # sitemap.py and search.py.
+    generated = []
+    rewritten = []
+    sitemap_state = search_state = None
+    if (config.get('sitemap') or config.get('feed')) and not dry_run:
+        from .sitemap import write_sitemaps
+        with profile.phase('sitemap'):
+            generated, changed, sitemap_state = write_sitemaps(
+                table, output_dir, config, cache_dir)
+        rewritten.extend(changed)
+        print("sitemaps: %d written, %d unchanged" % (
+            len(changed), len(generated) - len(changed)))
+
+    if config.get('search') and not dry_run:
+        from .search import write_search_index
+        with profile.phase('search'):
+            indexed, search_files, changed, search_state = (
+                write_search_index(table, manifest, output_dir, config,
+                                   cache_dir))
+        generated.extend(search_files)
+        rewritten.extend(changed)
+        print("search: %d route(s) indexed, %d file(s) written" % (
+            indexed, len(changed)))
+
+    # Precompress text outputs for servers that can send them as is:
+    #
+    #   compress:
+    #     min-size: 1024
+    #     brotli: true
+    compress = config.get('compress')
+    if compress and not dry_run:
+        from .compress import MIN_SIZE, compress_outputs
+        if not isinstance(compress, dict):
+            compress = {}
+        outputs = manifest.outputs()
+        outputs.extend(generated)
+        outputs.extend(os.path.join(output_dir, asset)
+                       for asset in manifest.assets)
+        # Which outputs changed goes by their content hashes; assets
+        # have theirs in their names.
+        changed = set(manifest.compress())
+        changed.update(rewritten)
+        with profile.phase('compress'):
+            compressed = compress_outputs(
+                outputs, compress.get('min-size', MIN_SIZE),
+                compress.get('brotli', True), jobs if jobs > 1 else None,
+                changed)
+        print("compressed: %d file(s)" % compressed)
+
+    # Clean up after routes that have been removed since the last build,
+    # and after assets whose content changed.
+    with profile.phase('cleanup'):
+        from .compress import remove_variants
+        removed = manifest.removed_assets()
+        if incremental:
+            removed.extend(manifest.removed())
+        for output in removed:
+            if not os.path.isfile(output):
+                continue
+            if dry_run:
+                print("would remove: " + output)
+            else:
+                os.remove(output)
+                remove_variants(output)
+    if not dry_run:
+        with profile.phase('swap'):
+            swap(output_dir, build_dir)
+        # Caches that describe the build directory are only saved once
+        # it's in place.
+        manifest.save()
+        if sitemap_state is not None:
+            from .sitemap import STATE
+            save_state(cache_dir, STATE, sitemap_state)
+        if search_state is not None:
+            from .search import STATE
+            save_state(cache_dir, STATE, search_state)
+        options = config.get('fragments')
+        if not isinstance(options, dict):
+            options = {}
+        prune(fragments_dir, options.get('max-size', MAX_SIZE))
+        if minifier:
+            prune(minified_dir, minify.get('max-size', MAX_SIZE))
+    if profile_fn:
+        profile.write(profile_fn)
+
+def serve(opts=None, args=None) -> None:
+    """Serve a liz project and rebuild it as files change.
+
+    Pages are rendered into memory rather than the build
+    directory. Anything that isn't a page, like assets/, is
+    served from the project directory.
+    """
+    from .serve import serve
+
+    try:
+        nopts, nargs = getopt.getopt(args, "p:", ["port="])
+        if nargs:
+            _fatal("'serve' doesn't accept any arguments.")
+    except getopt.GetoptError:
+        print(__doc__)
+        sys.exit(1)
+    port = 10101
+    for opt, arg in nopts:
+        if opt in ('-p', '--port'):
+            try:
+                port = int(arg)
+            except ValueError:
+                _fatal("'%s' is not a port." % arg)
+    serve(port)
+
+def deploy(opts=None, args=None) -> None:
+    """Deploy the build directory.
+
+    The target is a directory or an s3:// URL, given either as
+    an argument or in liz.yml along with backend options:
+
+        deploy:
+          target: s3://www.example.com
+          endpoint: http://localhost:9000
+          cache-control: no-cache
+    """
+    from .deploy import deploy, make_backend
+
+    config = load_config()
+    try:
+        nopts, nargs = getopt.getopt(args, "j:n", ["jobs=", "dry-run"])
+    except getopt.GetoptError:
+        print(__doc__)
+        sys.exit(1)
+    options = dict(config.get('deploy') or {})
+    if len(nargs) > 1:
+        _fatal("'deploy' takes a single target.")
+    elif nargs:
+        options['target'] = nargs[0]
+    jobs = options.get('jobs', 16)
+    dry_run = False
+    for opt, arg in nopts:
+        if opt in ('-j', '--jobs'):
+            try:
+                jobs = int(arg)
+            except ValueError:
+                _fatal("'%s' is not a number of jobs." % arg)
+        elif opt in ('-n', '--dry-run'):
+            dry_run = True
+    if not options.get('target'):
+        _fatal("no deploy target given.")
+    build_dir = config.get('build')
+    if not os.path.isdir(build_dir):
+        _fatal("nothing to deploy in '%s'." % build_dir)
+
+    try:
+        backend = make_backend(options['target'], options)
+        upload, delete = deploy(backend, build_dir, cache_dir, jobs, dry_run)
+    except RuntimeError as e:
+        _fatal(str(e))
+    if dry_run:
+        for key in upload:
+            print("would upload: " + key)
+        for key in delete:
+            print("would delete: " + key)
+        print("would upload %d file(s), delete %d" % (
+            len(upload), len(delete)))
+    else:
+        print("uploaded %d file(s), deleted %d" % (len(upload), len(delete)))
+
+def daemon(opts=None, args=None) -> None:
+    """Keep the project loaded and run builds sent by `liz build`.
+
+    Listens on a Unix socket in the cache directory until
+    interrupted or stopped with `liz daemon --stop`.
+    """
+    from . import daemon
+
+    try:
+        nopts, nargs = getopt.getopt(args, "", ["stop"])
+        if nargs:
+            _fatal("'daemon' doesn't accept any arguments.")
+    except getopt.GetoptError:
+        print(__doc__)
+        sys.exit(1)
+    if ('--stop', '') in nopts:
+        if not daemon.request_stop():
+            _fatal("no daemon is running.")
+        return
+    if not os.path.exists(config_fn):
+        _fatal("not a liz project.")
+    daemon.run()
 
 def main() -> None:
+    global IS_VERBOSE
     argv = sys.argv[1:]
     try:
         opts, args = getopt.getopt(argv,
@@ -432,7 +833,20 @@ def main() -> None:
     if command == 'init':
         init(opts, args)
     elif command == 'build':
+        if '--no-daemon' not in args:
+            from .daemon import request_build
+            status = request_build(opts, args)
+            if status is not None:
+                sys.exit(status)
         build(opts, args)
+    elif command == 'compile':
+        compile_templates(opts, args)
+    elif command == 'serve':
+        serve(opts, args)
+    elif command == 'deploy':
+        deploy(opts, args)
+    elif command == 'daemon':
+        daemon(opts, args)
     else:
         _fatal("unknown command: " + command)
 
@@ -0,0 +1,265 @@
+"""Build manifest used for incremental builds.
+
+The manifest records, for every rendered output, the inputs that went
+into it: the template and every template it extends, includes or
+imports, a hash of the data it was rendered with, and the files pulled
+in through `!file` and `!data-doc` tags.  The next build compares its
+routes against the manifest and only renders those whose inputs
+changed.
+
+It also records a hash of every output, so that outputs whose content
+didn't change aren't written again, and the fingerprinted assets the
+build wrote, so those of previous builds can be removed.
+
+Routes and outputs are recorded relative to the build directory, since
+a build writes to a staging copy of it (see output.py) while a dry run
+looks at the build directory itself.
+"""
+import hashlib
+import json
+import os
+
+from typing import Any, Dict, List, Optional
+
+from .output import atomic_write
+
+MANIFEST_VERSION = 4
+
+
+def digest(content: bytes) -> str:
+    return hashlib.sha1(content).hexdigest()
+
+
+def _json_default(obj):
+    # `!file` and `!data-doc` tags are loaded lazily; they're hashed by
+    # name and the file itself is tracked through `Manifest.stamp()`.
+    if getattr(obj, 'filename', None):
+        return {'file': obj.filename}
+    if hasattr(obj, 'layers'):
+        return dict(obj)
+    # Other YAML tags keep their payload in `value`.
+    if hasattr(obj, 'value'):
+        value = obj.value
+        if isinstance(value, bytes):
+            return value.decode('utf8', 'replace')
+        return value
+    return repr(obj)
+
+
+def fingerprint(obj: Any) -> str:
+    """Hash JSON-like data independently of key order."""
+    blob = json.dumps(obj, sort_keys=True, default=_json_default)
+    return digest(blob.encode('utf8'))
+
+
+class Manifest:
+    """Inputs and outputs of a build, plus those of the previous one."""
+
+    def __init__(self, filename: Optional[str], globals_: Any = None,
+                 root: str = ''):
+        self.filename = filename
+        # Where this build's outputs are; paths are recorded relative
+        # to it.
+        self.root = root
+        self.routes = {}  # type: Dict[str, Dict[str, Any]]
+        self.previous = {}  # type: Dict[str, Dict[str, Any]]
+        self.last = {}  # type: Dict[str, Dict[str, Any]]
+        # Fingerprinted assets of this build and of the previous one.
+        self.assets = []  # type: List[str]
+        self.last_assets = []  # type: List[str]
+        self._stamps = {}  # type: Dict[str, List]
+        self._templates = {}  # type: Dict[str, Dict[str, str]]
+        self._layers = {}  # type: Dict[str, Dict]
+        self.globals = fingerprint([globals_, self.file_deps(globals_)])
+        if not filename:
+            # Kept in memory only, e.g. by `liz serve`.
+            return
+        try:
+            with open(filename, 'r') as f:
+                previous = json.load(f)
+        except (OSError, ValueError):
+            return
+        if previous.get('version') != MANIFEST_VERSION:
+            return
+        self.last = previous.get('routes', {})
+        self.last_assets = previous.get('assets', [])
+        if previous.get('globals') != self.globals:
+            # URLs or template globals changed; every route is stale.
+            return
+        self.previous = self.last
+
+    def key(self, path: str) -> str:
+        """The path of an output relative to the build directory."""
+        if not self.root:
+            return path
+        key = os.path.relpath(path, self.root)
+        # Keep the trailing slash of routes that are directories.
+        if path.endswith('/') and not key.endswith('/'):
+            key += '/'
+        return key
+
+    def output(self, entry: Dict[str, Any]) -> str:
+        """Where the output of a manifest entry is in this build."""
+        return os.path.join(self.root, entry['output'])
+
+    def route(self, path: str) -> Optional[Dict[str, Any]]:
+        return self.routes.get(self.key(path))
+
+    def outputs(self) -> List[str]:
+        """Every output of this build."""
+        return [self.output(entry) for entry in self.routes.values()]
+
+    def stamp(self, filename: str) -> List:
+        """Return `[mtime, size]` of a file loaded by a YAML tag.
+
+        The file isn't read, so tags that no template uses never are.
+        """
+        if filename not in self._stamps:
+            try:
+                st = os.stat(filename)
+                self._stamps[filename] = [st.st_mtime_ns, st.st_size]
+            except OSError:
+                self._stamps[filename] = [None, None]
+        return self._stamps[filename]
+
+    def file_deps(self, obj: Any, deps: Optional[Dict] = None) -> Dict:
+        """Find files loaded by `!file`/`!data-doc` tags inside `obj`."""
+        if deps is None:
+            deps = {}
+        if hasattr(obj, 'layers'):
+            for layer in obj.layers():
+                if layer.parent is not None:
+                    self.file_deps(layer.data, deps)
+                    continue
+                # The global data is shared by every route; walk it once.
+                key = layer.fingerprint()
+                if key not in self._layers:
+                    self._layers[key] = self.file_deps(layer.data)
+                deps.update(self._layers[key])
+            return deps
+        filename = getattr(obj, 'filename', None)
+        if filename:
+            deps[filename] = self.stamp(filename)
+        elif isinstance(obj, dict):
+            for value in obj.values():
+                self.file_deps(value, deps)
+        elif isinstance(obj, (list, tuple)):
+            for value in obj:
+                self.file_deps(value, deps)
+        return deps
+
+    def template_deps(self, env, name: str) -> Dict[str, str]:
+        """Map a template and everything it references to source hashes.
+
+        References are found by walking the Jinja AST for `extends`,
+        `include` and `import` tags.  A dynamic reference could point
+        anywhere, so it makes the template depend on all of them.
+        """
+        from jinja2 import meta
+
+        if name in self._templates:
+            return self._templates[name]
+        deps = {}
+        pending = [name]
+        while pending:
+            current = pending.pop()
+            if current in deps:
+                continue
+            source, _, _ = env.loader.get_source(env, current)
+            deps[current] = digest(source.encode('utf8'))
+            for ref in meta.find_referenced_templates(env.parse(source)):
+                if ref is None:
+                    pending.extend(env.list_templates())
+                else:
+                    pending.append(ref)
+        self._templates[name] = deps
+        return deps
+
+    def all_template_deps(self, env, names) -> Dict[str, str]:
+        """`template_deps()` of several templates, merged.
+
+        Templates that can't be loaded are left out.
+        """
+        from jinja2 import TemplateError
+
+        deps = {}
+        for name in names:
+            try:
+                deps.update(self.template_deps(env, name))
+            except TemplateError:
+                pass
+        return deps
+
+    def entry(self, env, template: str, data: Any) -> Dict[str, Any]:
+        """Describe the inputs of a single route."""
+        return {
+            'template': template,
+            'templates': self.template_deps(env, template),
+            'data': (data.fingerprint() if hasattr(data, 'fingerprint')
+                     else fingerprint(data)),
+            'files': self.file_deps(data),
+        }
+
+    def reuse(self, path: str, entry: Dict[str, Any]) -> bool:
+        """Keep the previous output of `path` if its inputs are unchanged."""
+        path = self.key(path)
+        previous = self.previous.get(path)
+        if not previous or 'output' not in previous:
+            return False
+        for key in ('template', 'templates', 'data', 'files'):
+            if previous.get(key) != entry[key]:
+                return False
+        if not os.path.exists(self.output(previous)):
+            return False
+        self.routes[path] = previous
+        return True
+
+    def output_hash(self, path: str) -> Optional[str]:
+        """Hash of what the previous build wrote for `path`."""
+        return self.last.get(self.key(path), {}).get('hash')
+
+    def add(self, path: str, entry: Dict[str, Any], output: str,
+            content_hash: Optional[str] = None) -> None:
+        entry['output'] = self.key(output)
+        entry['hash'] = content_hash
+        previous = self.last.get(self.key(path), {})
+        if previous.get('hash') == content_hash and 'compressed' in previous:
+            # Its compressed variants are still those of this content.
+            entry['compressed'] = previous['compressed']
+        self.routes[self.key(path)] = entry
+
+    def compress(self) -> List[str]:
+        """Outputs whose compressed variants are of other content.
+
+        They're recorded as compressed from now on, so this is only
+        called by builds that compress their outputs.
+        """
+        stale = []
+        for entry in self.routes.values():
+            if entry.get('compressed') != entry['hash']:
+                stale.append(self.output(entry))
+                entry['compressed'] = entry['hash']
+        return stale
+
+    def removed(self) -> List[str]:
+        """Outputs of the previous build whose routes no longer exist."""
+        return [os.path.join(self.root, entry.get('output', path))
+                for path, entry in self.last.items()
+                if path not in self.routes]
+
+    def removed_assets(self) -> List[str]:
+        """Assets of the previous build that this one doesn't have."""
+        assets = set(self.assets)
+        return [os.path.join(self.root, asset)
+                for asset in self.last_assets if asset not in assets]
+
+    def save(self) -> None:
+        head, _ = os.path.split(self.filename)
+        if head:
+            os.makedirs(head, exist_ok=True)
+        atomic_write(self.filename, json.dumps({
+            'version': MANIFEST_VERSION,
+            'globals': self.globals,
+            'routes': self.routes,
+            'assets': self.assets,
+        }))
@@ -0,0 +1,214 @@
+"""Minified HTML, CSS and JavaScript outputs.
+
+    minify:
+      html: true
+      css: true
+      js: true
+      exclude: ['raw/*', 'feed.xml']
+      max-size: 67108864
+
+Routes are minified after they're rendered and before they're hashed
+and written, in the same processes that render them, so `liz build -j`
+minifies in parallel too.  Whitespace and comments are removed from
+HTML, including inline `<style>` and `<script>`, but `<pre>` and
+`<textarea>` are left as they are.  JavaScript is only minified when
+the `rjsmin` module is installed.  Routes can opt out with `exclude`,
+which matches their paths in the build directory, or with `minify:
+false` in their data.
+
+Minified outputs are kept in the cache directory by the hash of what
+was rendered, so a page that renders the same as in a previous build
+isn't minified again.  The least recently used ones are removed once
+they take more than `max-size` bytes, like `{% cache %}` fragments.
+"""
+import fnmatch
+import os
+import re
+
+from typing import Any, Dict, Optional, Tuple
+
+try:
+    import rjsmin
+except ImportError:
+    rjsmin = None
+
+from .manifest import digest, fingerprint
+from .output import atomic_write
+
+# Changing how outputs are minified must change every cache key.
+MINIFY_VERSION = 1
+
+HTML_EXTENSIONS = ('.html', '.htm')
+
+# Comments and elements whose content isn't plain markup.
+RAW = re.compile(r'<!--.*?-->|<(pre|textarea|script|style)\b[^>]*>.*?'
+                 r'</\1\s*>', re.S | re.I)
+TAG = re.compile(r'(<[^>]*>)')
+TAG_NAME = re.compile(r'</?([a-zA-Z0-9!]+)')
+SPACE = re.compile(r'\s+')
+
+# Whitespace next to these tags isn't rendered.
+BLOCK_TAGS = {
+    '!doctype', 'html', 'head', 'body', 'title', 'meta', 'link', 'base',
+    'address', 'article', 'aside', 'blockquote', 'br', 'caption', 'col',
+    'colgroup', 'dd', 'details', 'div', 'dl', 'dt', 'fieldset',
+    'figcaption', 'figure', 'footer', 'form', 'h1', 'h2', 'h3', 'h4',
+    'h5', 'h6', 'header', 'hr', 'legend', 'li', 'main', 'nav',
+    'noscript', 'ol', 'p', 'pre', 'section', 'summary', 'table', 'tbody',
+    'td', 'tfoot', 'th', 'thead', 'tr', 'ul',
+}
+
+SCRIPT_TYPES = ('', 'text/javascript', 'application/javascript', 'module')
+SCRIPT_TYPE = re.compile(r'\stype\s*=\s*["\']?([^"\'\s>]*)', re.I)
+
+CSS_TOKENS = re.compile(r'("(?:\\.|[^"\\])*"|\'(?:\\.|[^\'\\])*\'|'
+                        r'/\*.*?\*/)', re.S)
+CSS_PUNCTUATION = re.compile(r'\s*([{};,>])\s*')
+
+
+def minify_css(css: str) -> str:
+    """Remove comments and whitespace that CSS doesn't need."""
+    out = []
+    for i, token in enumerate(CSS_TOKENS.split(css)):
+        if i % 2:
+            # `/*! ... */` comments are licenses; keep them.
+            if not token.startswith('/*') or token.startswith('/*!'):
+                out.append(token)
+            continue
+        token = CSS_PUNCTUATION.sub(r'\1', SPACE.sub(' ', token))
+        out.append(token.replace(';}', '}'))
+    return ''.join(out).strip()
+
+
+def minify_js(js: str) -> str:
+    if rjsmin is None:
+        return js
+    return rjsmin.jsmin(js)
+
+
+def _is_block(tag: Optional[str]) -> bool:
+    if tag is None:
+        return True
+    match = TAG_NAME.match(tag)
+    return bool(match) and match.group(1).lower() in BLOCK_TAGS
+
+
+def _markup(html: str, before: Optional[str], after: Optional[str]) -> str:
+    """Collapse the whitespace of markup between `before` and `after`."""
+    parts = TAG.split(html)
+    for i in range(0, len(parts), 2):
+        text = SPACE.sub(' ', parts[i])
+        if _is_block(parts[i - 1] if i else before):
+            text = text.lstrip()
+        if _is_block(parts[i + 1] if i + 1 < len(parts) else after):
+            text = text.rstrip()
+        parts[i] = text
+    return ''.join(parts)
+
+
+def _raw(match) -> str:
+    element = match.group(0)
+    tag = (match.group(1) or '').lower()
+    if tag not in ('script', 'style'):
+        return element
+    start = element.index('>') + 1
+    end = element.rindex('<')
+    body = element[start:end]
+    if tag == 'style':
+        body = minify_css(body)
+    else:
+        script_type = SCRIPT_TYPE.search(element[:start])
+        if script_type and script_type.group(1).lower() not in SCRIPT_TYPES:
+            # E.g. JSON or templates for the browser.
+            return element
+        body = minify_js(body)
+    return element[:start] + body + element[end:]
+
+
+def minify_html(html: str) -> str:
+    """Remove comments and whitespace that browsers don't render."""
+    out = []
+    pending = ''
+    before = None
+    pos = 0
+    for match in RAW.finditer(html):
+        pending += html[pos:match.start()]
+        pos = match.end()
+        element = match.group(0)
+        if element.startswith('<!--'):
+            # Conditional comments still mean something to old IEs.
+            if element.startswith('<!--[if'):
+                pending += element
+            continue
+        out.append(_markup(pending, before, element))
+        out.append(_raw(match))
+        pending = ''
+        before = element
+    out.append(_markup(pending + html[pos:], before, None))
+    return ''.join(out)
+
+
+MINIFIERS = {
+    'html': minify_html,
+    'css': minify_css,
+    'js': minify_js,
+}
+
+
+def _kind(path: str) -> Optional[str]:
+    if path.endswith(HTML_EXTENSIONS):
+        return 'html'
+    if path.endswith('.css'):
+        return 'css'
+    if path.endswith(('.js', '.mjs')):
+        return 'js'
+    return None
+
+
+class Minifier:
+    """Minifies outputs, keeping the results in `directory`."""
+
+    def __init__(self, options: Dict[str, Any], output_dir: str,
+                 directory: Optional[str] = None):
+        self.kinds = [kind for kind in MINIFIERS if options.get(kind, True)]
+        self.exclude = list(options.get('exclude') or [])
+        self.output_dir = output_dir
+        self.directory = directory
+        self.salt = fingerprint([MINIFY_VERSION, self.kinds,
+                                 rjsmin is not None])
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, key[:2], key)
+
+    def _excluded(self, path: str, data: Any) -> bool:
+        if data.get('minify', True) is False:
+            return True
+        url = os.path.relpath(path, self.output_dir)
+        return any(fnmatch.fnmatch(url, pattern) for pattern in self.exclude)
+
+    def minify(self, path: str, content: bytes,
+               data: Any) -> Tuple[bytes, Optional[str]]:
+        """Return the minified `content` of `path`.
+
+        Also returns whether it was minified (`'minified'`), taken from
+        the cache (`'cached'`) or left alone (None).
+        """
+        kind = _kind(path)
+        if kind not in self.kinds or self._excluded(path, data):
+            return content, None
+        key = digest(self.salt.encode('utf8') + content)
+        if self.directory:
+            try:
+                with open(self._path(key), 'rb') as f:
+                    minified = f.read()
+                # Marks it as recently used for `prune()`.
+                os.utime(self._path(key))
+                return minified, 'cached'
+            except OSError:
+                pass
+        minified = MINIFIERS[kind](content.decode('utf8')).encode('utf8')
+        if self.directory:
+            path = self._path(key)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            atomic_write(path, minified)
+        return minified, 'minified'
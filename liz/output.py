@@ -0,0 +1,187 @@
+"""Writing builds without disturbing the build directory.
+
+`liz build` writes into a staging directory next to the build
+directory (`build.liz-staging/` for `build/`) rather than into the
+build directory itself.  The staging directory starts out as hard
+links to every file of the previous build, so unchanged files are
+neither copied nor written again, and new content always replaces a
+link rather than writing through it.  Once the build succeeds, the two
+directories are swapped atomically (with `renameat2` on Linux, or two
+renames elsewhere) and the previous build is removed.  A build that
+fails leaves the build directory as it was.
+
+Outputs are written by a pool of threads fed through a bounded queue,
+so rendering doesn't wait on the disk, and every directory is created
+once per build rather than once per file.
+
+Every other file liz writes, in the build or cache directories, goes
+through `atomic_write()` too, so none is ever seen half written.
+"""
+import ctypes
+import json
+import os
+import queue
+import shutil
+import threading
+import time
+
+from typing import Any, Dict, List, Optional, Set, Tuple, Union
+
+STAGING_SUFFIX = '.liz-staging'
+
+AT_FDCWD = -100
+RENAME_EXCHANGE = 2
+
+
+def staging_dir(build_dir: str) -> str:
+    return build_dir.rstrip('/' + os.sep) + STAGING_SUFFIX
+
+
+def atomic_write(path: str, content: Union[bytes, str]) -> None:
+    """Replace `path` with `content`, written to a temporary file first.
+
+    A file that's replaced rather than written through also leaves the
+    files it's hard linked to alone.
+    """
+    if isinstance(content, str):
+        content = content.encode('utf8')
+    tmp = '%s.%d.%d.tmp' % (path, os.getpid(), threading.get_ident())
+    with open(tmp, 'wb') as f:
+        f.write(content)
+    os.replace(tmp, path)
+
+
+def load_state(cache_dir: str, name: str) -> Dict[str, Any]:
+    """What `save_state()` kept as `name`, or `{}`."""
+    try:
+        with open(os.path.join(cache_dir, name), 'r') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def save_state(cache_dir: str, name: str, state: Dict[str, Any]) -> None:
+    """Keep `state` in the cache directory for the next build."""
+    os.makedirs(cache_dir, exist_ok=True)
+    atomic_write(os.path.join(cache_dir, name), json.dumps(state))
+
+
+def link_tree(src: str, dst: str) -> int:
+    """Hard link every file under `src` into `dst`; returns the count."""
+    linked = 0
+    for dirpath, dirnames, filenames in os.walk(src):
+        target = os.path.join(dst, os.path.relpath(dirpath, src))
+        os.makedirs(target, exist_ok=True)
+        for name in list(dirnames):
+            if os.path.islink(os.path.join(dirpath, name)):
+                # os.walk doesn't follow these; keep them as links.
+                dirnames.remove(name)
+                filenames.append(name)
+        for fn in filenames:
+            source = os.path.join(dirpath, fn)
+            dest = os.path.join(target, fn)
+            if os.path.islink(source):
+                os.symlink(os.readlink(source), dest)
+                continue
+            try:
+                os.link(source, dest)
+            except OSError:
+                # E.g. a file system without hard links.
+                shutil.copy2(source, dest)
+            linked += 1
+    return linked
+
+
+def stage(build_dir: str) -> str:
+    """Set up the staging directory for a build and return it."""
+    staging = staging_dir(build_dir)
+    if os.path.lexists(staging):
+        # Left behind by a build that failed.
+        shutil.rmtree(staging)
+    os.makedirs(staging)
+    if os.path.isdir(build_dir):
+        link_tree(build_dir, staging)
+    return staging
+
+
+def _exchange(a: str, b: str) -> bool:
+    try:
+        renameat2 = ctypes.CDLL(None, use_errno=True).renameat2
+    except (OSError, AttributeError):
+        return False
+    return renameat2(AT_FDCWD, os.fsencode(a), AT_FDCWD, os.fsencode(b),
+                     RENAME_EXCHANGE) == 0
+
+
+def swap(staging: str, build_dir: str) -> None:
+    """Make `staging` the build directory and remove the previous build."""
+    build_dir = build_dir.rstrip('/' + os.sep)
+    if not os.path.lexists(build_dir):
+        os.rename(staging, build_dir)
+        return
+    if _exchange(staging, build_dir):
+        shutil.rmtree(staging)
+        return
+    # Without an atomic exchange the build directory is briefly missing.
+    previous = build_dir + '.liz-previous'
+    if os.path.lexists(previous):
+        shutil.rmtree(previous)
+    os.rename(build_dir, previous)
+    os.rename(staging, build_dir)
+    shutil.rmtree(previous)
+
+
+class Writer:
+    """Writes files handed to it from a pool of threads.
+
+    With `timed`, the wall and CPU time spent writing each file are
+    kept in `times` for `liz build --profile`.
+    """
+
+    def __init__(self, threads: int = 4, depth: int = 256,
+                 timed: bool = False):
+        # `write()` blocks once `depth` files are waiting, which keeps
+        # rendering from running too far ahead of the disk.
+        self.queue = queue.Queue(depth)  # type: queue.Queue
+        self.dirs = set()  # type: Set[str]
+        self.errors = []  # type: List[Tuple[str, str]]
+        self.timed = timed
+        self.times = {}  # type: Dict[str, List[float]]
+        self.threads = [threading.Thread(target=self._run, daemon=True)
+                        for _ in range(threads)]
+        for thread in self.threads:
+            thread.start()
+
+    def write(self, path: str, content: bytes) -> None:
+        self.queue.put((path, content))
+
+    def _write(self, path: str, content: bytes) -> None:
+        head = os.path.dirname(path)
+        if head and head not in self.dirs:
+            os.makedirs(head, exist_ok=True)
+            self.dirs.add(head)
+        # A new file replaces the previous one, which may be linked
+        # from the live build directory.
+        atomic_write(path, content)
+
+    def _run(self) -> None:
+        while True:
+            item = self.queue.get()  # type: Optional[Tuple[str, bytes]]
+            if item is None:
+                return
+            wall, cpu = time.perf_counter(), time.thread_time()
+            try:
+                self._write(*item)
+            except OSError as e:
+                self.errors.append((item[0], str(e)))
+            if self.timed:
+                self.times[item[0]] = [time.perf_counter() - wall,
+                                       time.thread_time() - cpu]
+
+    def close(self) -> List[Tuple[str, str]]:
+        """Wait for every file to be written; returns any failures."""
+        for _ in self.threads:
+            self.queue.put(None)
+        for thread in self.threads:
+            thread.join()
+        return self.errors
@@ -0,0 +1,127 @@
+"""Timing and memory report for `liz build --profile`.
+
+Build phases are timed in the main process.  Every rendered route
+also reports how long its template took to load, render, encode,
+minify and hash, wherever it was rendered, and how long its output
+took to write in the writer threads.  The report is printed as a summary
+and written out as JSON so that runs can be compared, e.g. in CI.
+"""
+import json
+import resource
+import sys
+import time
+
+from contextlib import contextmanager
+from typing import Any, Dict, List
+
+# Steps of rendering a single route, in order.
+ROUTE_STEPS = ('load', 'render', 'encode', 'minify', 'hash', 'write')
+
+# How many of the slowest routes and templates to report.
+TOP = 20
+
+
+class Stopwatch:
+    """Wall and CPU time of consecutive steps."""
+
+    def __init__(self):
+        self.times = {}  # type: Dict[str, List[float]]
+        self._wall = time.perf_counter()
+        self._cpu = time.process_time()
+
+    def lap(self, name: str) -> None:
+        wall, cpu = time.perf_counter(), time.process_time()
+        self.times[name] = [wall - self._wall, cpu - self._cpu]
+        self._wall, self._cpu = wall, cpu
+
+
+def _peak_rss_kb(who: int) -> int:
+    rss = resource.getrusage(who).ru_maxrss
+    # macOS reports bytes, Linux kilobytes.
+    return rss // 1024 if sys.platform == 'darwin' else rss
+
+
+class Profile:
+    def __init__(self):
+        self.phases = {}  # type: Dict[str, List[float]]
+        self.routes = []  # type: List[Dict[str, Any]]
+        self.templates = {}  # type: Dict[str, Dict[str, Any]]
+        self.totals = {step: [0.0, 0.0] for step in ROUTE_STEPS}
+
+    @contextmanager
+    def phase(self, name: str):
+        watch = Stopwatch()
+        try:
+            yield
+        finally:
+            watch.lap(name)
+            self.phases[name] = watch.times[name]
+
+    def route(self, path: str, template: str,
+              times: Dict[str, List[float]]) -> None:
+        wall = sum(t[0] for t in times.values())
+        cpu = sum(t[1] for t in times.values())
+        for step, (step_wall, step_cpu) in times.items():
+            self.totals[step][0] += step_wall
+            self.totals[step][1] += step_cpu
+        stats = self.templates.setdefault(template, {
+            'template': template, 'routes': 0, 'wall': 0.0, 'load': 0.0,
+        })
+        stats['routes'] += 1
+        stats['wall'] += wall
+        stats['load'] += times.get('load', [0.0])[0]
+        # Only the slowest routes are kept, so the report stays small
+        # for large sites.
+        self.routes.append({
+            'path': path,
+            'template': template,
+            'wall': wall,
+            'cpu': cpu,
+            'steps': {step: t[0] for step, t in times.items()},
+        })
+        if len(self.routes) > 2 * TOP:
+            self.routes.sort(key=lambda r: -r['wall'])
+            del self.routes[TOP:]
+
+    def report(self) -> Dict[str, Any]:
+        routes = sorted(self.routes, key=lambda r: -r['wall'])[:TOP]
+        templates = sorted(self.templates.values(),
+                           key=lambda t: -t['wall'])[:TOP]
+        return {
+            'phases': {name: {'wall': wall, 'cpu': cpu}
+                       for name, (wall, cpu) in self.phases.items()},
+            'route_steps': {step: {'wall': wall, 'cpu': cpu}
+                            for step, (wall, cpu) in self.totals.items()},
+            'routes': sum(t['routes'] for t in self.templates.values()),
+            'slowest_routes': routes,
+            'slowest_templates': templates,
+            'peak_rss_kb': {
+                'build': _peak_rss_kb(resource.RUSAGE_SELF),
+                'workers': _peak_rss_kb(resource.RUSAGE_CHILDREN),
+            },
+        }
+
+    def write(self, filename: str) -> None:
+        report = self.report()
+        with open(filename, 'w') as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+
+        print("\nphase        wall       cpu")
+        for name, t in report['phases'].items():
+            print("%-10s %7.3fs  %7.3fs" % (name, t['wall'], t['cpu']))
+        print("\n%d routes rendered" % report['routes'])
+        for step, t in report['route_steps'].items():
+            print("  %-8s %7.3fs  %7.3fs" % (step, t['wall'], t['cpu']))
+        print("\nslowest routes:")
+        for r in report['slowest_routes'][:10]:
+            print("  %8.1fms  %s (%s)" % (r['wall'] * 1000, r['path'],
+                                         r['template']))
+        print("\nslowest templates:")
+        for t in report['slowest_templates'][:10]:
+            print("  %8.1fms  %s (%d routes, %.1fms loading)" % (
+                t['wall'] * 1000, t['template'], t['routes'],
+                t['load'] * 1000))
+        print("\npeak memory: %d KB (workers: %d KB)" % (
+            report['peak_rss_kb']['build'],
+            report['peak_rss_kb']['workers']))
+        print("profile written to " + filename)
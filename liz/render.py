@@ -0,0 +1,258 @@
+"""Route rendering, either in-process or in a pool of workers.
+
+Every worker builds its own Jinja `Environment` from the same
+templates directory, URL map and template globals, so rendering a
+route gives the same bytes no matter which process does it.
+"""
+import os
+import traceback
+
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from jinja2 import (Environment, FileSystemBytecodeCache, FileSystemLoader,
+                    TemplateError, nodes)
+from jinja2.defaults import DEFAULT_NAMESPACE
+
+from .context import Layer
+from .fragments import FragmentCache, FragmentCacheExtension
+from .manifest import digest
+from .profile import Stopwatch
+
+# The environment used by `render_route` in this process.
+_env = None
+
+# What `render_route` minifies outputs with, if anything.
+_minifier = None
+
+# Environments kept from build to build, keyed by their templates and
+# bytecode directories; only `liz daemon` keeps them.
+_envs = None  # type: Optional[Dict[Tuple, Environment]]
+
+
+class BytecodeCache(FileSystemBytecodeCache):
+    """On-disk bytecode cache that counts its hits and misses.
+
+    Jinja stores a checksum of the template source next to the
+    bytecode and ignores the cached copy once the source changes.
+    """
+
+    def __init__(self, directory: str):
+        os.makedirs(directory, exist_ok=True)
+        super().__init__(directory)
+        self.hits = 0
+        self.misses = 0
+
+    def load_bytecode(self, bucket) -> None:
+        super().load_bytecode(bucket)
+        if bucket.code is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+
+    def take(self) -> Tuple[int, int]:
+        """Return `(hits, misses)` since the last call."""
+        stats = self.hits, self.misses
+        self.hits = self.misses = 0
+        return stats
+
+
+def make_url(urls: Dict[str, str]):
+    """The `url()` template global: a route's URL by its name."""
+    def url(name: str) -> str:
+        try:
+            return urls[name]
+        except KeyError:
+            raise KeyError("no route named '%s'." % name)
+    return url
+
+
+def url_names(env: Environment, name: str) -> List[Tuple[str, int]]:
+    """Find the `url('...')` calls in a template with a constant name.
+
+    Returns `(route name, line number)` for each of them; calls with
+    a computed name can only be checked while rendering.
+    """
+    source, _, _ = env.loader.get_source(env, name)
+    found = []
+    for call in env.parse(source).find_all(nodes.Call):
+        if (isinstance(call.node, nodes.Name) and call.node.name == 'url'
+                and call.args and isinstance(call.args[0], nodes.Const)
+                and isinstance(call.args[0].value, str)):
+            found.append((call.args[0].value, call.lineno))
+    return found
+
+
+def check_urls(env: Environment, templates: Iterable[str],
+               urls: Dict[str, str]) -> List[str]:
+    """Describe every `url()` call to a route that doesn't exist."""
+    problems = []
+    for name in sorted(set(templates)):
+        try:
+            calls = url_names(env, name)
+        except TemplateError:
+            # Missing or broken templates are reported by the render.
+            continue
+        for route, lineno in calls:
+            if route not in urls:
+                problems.append("%s:%d: no route named '%s'." % (
+                    name, lineno, route))
+    return problems
+
+
+def keep_envs() -> None:
+    """Reuse environments, and the templates they compiled, from now on.
+
+    Jinja checks templates for changes before reusing them.
+    """
+    global _envs
+    if _envs is None:
+        _envs = {}
+
+
+def make_env(templates_dir: str, urls: Dict[str, str],
+             template_globals: Optional[Dict[str, Any]] = None,
+             bytecode_dir: Optional[str] = None,
+             fragments: Optional[FragmentCache] = None) -> Environment:
+    key = (templates_dir, bytecode_dir)
+    env = _envs.get(key) if _envs is not None else None
+    if env is None:
+        cache = BytecodeCache(bytecode_dir) if bytecode_dir else None
+        env = Environment(loader=FileSystemLoader(templates_dir),
+                          bytecode_cache=cache,
+                          extensions=[FragmentCacheExtension])
+        if _envs is not None:
+            _envs[key] = env
+    else:
+        # Loaded templates look globals up in this same dict.
+        env.globals.clear()
+        env.globals.update(DEFAULT_NAMESPACE)
+    env.fragment_cache = fragments
+    env.globals['url'] = make_url(urls)
+    if template_globals:
+        for k, v in template_globals.items():
+            env.globals[k] = v
+    return env
+
+
+def init_worker(templates_dir, urls, template_globals, bytecode_dir,
+                fragments=None, minifier=None) -> None:
+    global _env, _minifier
+    _env = make_env(templates_dir, urls, template_globals, bytecode_dir,
+                    fragments)
+    _minifier = minifier
+
+
+def _cache_stats() -> Tuple[int, int]:
+    if _env.bytecode_cache is None:
+        return 0, 0
+    return _env.bytecode_cache.take()
+
+
+def output_path(path: str) -> str:
+    """Where a route's content ends up; directories get an index.html."""
+    if path.endswith('/') or os.path.isdir(path):
+        return path + 'index.html'
+    return path
+
+
+def check_output(path: str, content: bytes,
+                 previous: Optional[str] = None) -> Tuple[str, str, bool]:
+    """Find out whether `content` for `path` needs to be written.
+
+    `previous` is the hash of what the last build wrote.  Returns the
+    file to write, the hash of `content` and whether it changed.
+    """
+    content_hash = digest(content)
+    output = output_path(path)
+    if content_hash == previous and os.path.isfile(output):
+        return output, content_hash, False
+    return output, content_hash, True
+
+
+def _context(env: Environment, data: Dict) -> Dict:
+    context = dict(data)
+    # Templates can also reach the route's data through `data`, which
+    # shadows the global `data` that imported macros see.
+    context.setdefault('data', data)
+    return context
+
+
+def render_content(env: Environment, template: str, data: Dict) -> str:
+    return env.get_template(template).render(_context(env, data))
+
+
+def render_route(job: Tuple) -> Tuple:
+    """Render a single route.
+
+    `job` is `(path, template, data, previous_hash, dry_run)`, where
+    `data` is the route's own data.  It's layered over the global data
+    that reached this process once, as the `data` template global,
+    rather than sending the global data along with every route.
+    Returns `(path, output, error, info, content)`, where `content` is
+    what to write to `output`, or None if nothing needs writing.
+    Exceptions are caught and returned as formatted tracebacks so one
+    broken route doesn't stop the rest.  `info` holds the content
+    `hash`, whether it `changed`, the bytecode cache `hits` and
+    `misses` since the previous route rendered by this process,
+    whether it was `minified` or taken from the cache, and the wall
+    and CPU `times` of each step.
+    """
+    path, template, data, previous, dry_run = job
+    data = Layer(data, _env.globals.get('data'))
+    watch = Stopwatch()
+    output = error = content_hash = content = minified = None
+    changed = False
+    try:
+        loader = _env.get_template(template)
+        watch.lap('load')
+        content = loader.render(_context(_env, data))
+        watch.lap('render')
+        content = content.encode('utf8')
+        watch.lap('encode')
+        if _minifier is not None:
+            content, minified = _minifier.minify(output_path(path),
+                                                 content, data)
+        watch.lap('minify')
+        output, content_hash, changed = check_output(path, content, previous)
+        watch.lap('hash')
+    except Exception:
+        error = traceback.format_exc()
+    if error or not changed or dry_run:
+        content = None
+    hits, misses = _cache_stats()
+    info = {'hash': content_hash, 'changed': changed, 'hits': hits,
+            'misses': misses, 'minified': minified, 'times': watch.times}
+    return path, output, error, info, content
+
+
+def render_routes(jobs: Iterable[Tuple], templates_dir: str,
+                  urls: Dict[str, str], template_globals=None,
+                  processes: int = 1,
+                  bytecode_dir: Optional[str] = None,
+                  fragments: Optional[FragmentCache] = None,
+                  minifier=None) -> Iterator[Tuple]:
+    """Render jobs for `render_route`, yielding results as they finish."""
+    initargs = (templates_dir, urls, template_globals, bytecode_dir,
+                fragments, minifier)
+    if processes <= 1:
+        init_worker(*initargs)
+        for job in jobs:
+            yield render_route(job)
+        return
+
+    import multiprocessing
+    import threading
+
+    # The pool would otherwise read every job up front; only let a
+    # bounded number of them be in flight at once.
+    slots = threading.BoundedSemaphore(processes * 64)
+    def throttled():
+        for job in jobs:
+            slots.acquire()
+            yield job
+
+    with multiprocessing.Pool(processes, init_worker, initargs) as pool:
+        for result in pool.imap_unordered(render_route, throttled(),
+                                          chunksize=16):
+            slots.release()
+            yield result
@@ -0,0 +1,336 @@
+"""A search index built from the rendered routes.
+
+    search:
+      path: search
+      prefix: 2
+      exclude: ['404.html', 'drafts/*']
+
+Text is taken from every route's output, leaving out tags, scripts and
+styles, and from the `doc` of `!data-doc` tags in the route's data.
+Routes can leave the index with `search: false` in their data.  The
+index is written as JSON files under `path` in the build directory:
+
+- `index.json` lists the shards and how many `docs-N.json` files
+  there are: `{"version": 2, "prefix": 2, "shards": ["ab", ...],
+  "docs": 1000, "files": 3}`.
+- `words/<prefix>.json` maps every word starting with `<prefix>` (its
+  first `prefix` characters, lowercased) to the ids of the routes it's
+  in: `{"about": [0, 12]}`.
+- `docs-N.json` holds `[url, title]` of routes `N * docs` up to
+  `(N + 1) * docs`, indexed by id; removed routes leave `null`.
+
+A search page only fetches `index.json`, the shards of the words
+searched for and the docs files of the results.
+
+Only routes whose output or `!data-doc` files changed are read again;
+the shards and docs files they're in are updated from the previous
+build, and the others are left alone.
+"""
+import fnmatch
+import html.parser
+import json
+import os
+import re
+import shutil
+
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+
+from .compress import remove_variants
+from .manifest import fingerprint
+from .output import atomic_write, load_state
+
+INDEX_VERSION = 2
+
+PREFIX = 2
+MIN_LENGTH = 2
+MAX_LENGTH = 40
+DOCS_PER_FILE = 1000
+
+# What's been indexed, kept in the cache directory.
+STATE = 'search.json'
+
+WORD = re.compile(r'\w+')
+
+# Elements whose text isn't part of the page's content.
+SKIPPED = {'script', 'style', 'template', 'noscript', 'svg'}
+
+
+class _TextParser(html.parser.HTMLParser):
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.text = []  # type: List[str]
+        self.title = []  # type: List[str]
+        self._skipping = 0
+        self._in_title = False
+
+    def handle_starttag(self, tag, attrs):
+        if tag in SKIPPED:
+            self._skipping += 1
+        elif tag == 'title':
+            self._in_title = True
+
+    def handle_endtag(self, tag):
+        if tag in SKIPPED and self._skipping:
+            self._skipping -= 1
+        elif tag == 'title':
+            self._in_title = False
+
+    def handle_data(self, data):
+        if self._in_title:
+            self.title.append(data)
+        elif not self._skipping:
+            self.text.append(data)
+
+
+def extract(content: str) -> Tuple[str, str]:
+    """Return the `(title, text)` of an HTML page."""
+    parser = _TextParser()
+    parser.feed(content)
+    parser.close()
+    return (' '.join(''.join(parser.title).split()),
+            ' '.join(parser.text))
+
+
+def words(text: str, min_length: int = MIN_LENGTH) -> Set[str]:
+    return set(word for word in WORD.findall(text.lower())
+               if min_length <= len(word) <= MAX_LENGTH)
+
+
+def _docs(data: Dict[str, Any]) -> List[str]:
+    """The `doc` of every `!data-doc` tag in a route's own data."""
+    docs = []
+    for value in data.values():
+        if getattr(value, 'yaml_tag', None) == '!data-doc':
+            doc = value.get('doc')
+            if doc:
+                docs.append(str(doc))
+    return docs
+
+
+def _read_json(path: str) -> Any:
+    try:
+        with open(path, 'r', encoding='utf8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _write_json(path: str, value: Any) -> None:
+    atomic_write(path, json.dumps(value, ensure_ascii=False,
+                                  separators=(',', ':'), sort_keys=True))
+
+
+class SearchIndex:
+    """Updates the index in `output_dir` from the previous build's."""
+
+    def __init__(self, output_dir: str, options: Dict[str, Any],
+                 cache_dir: str):
+        self.output_dir = output_dir
+        self.directory = os.path.join(output_dir,
+                                      options.get('path', 'search'))
+        self.prefix = int(options.get('prefix', PREFIX))
+        self.min_length = int(options.get('min-length', MIN_LENGTH))
+        self.exclude = list(options.get('exclude') or [])
+        self.options = fingerprint([INDEX_VERSION, self.prefix,
+                                    self.min_length])
+        # path => [id, key, prefixes] of every route in the index.
+        self.routes = {}  # type: Dict[str, List]
+        self.shards = set()  # type: Set[str]
+        state = load_state(cache_dir, STATE)
+        index = _read_json(os.path.join(self.directory, 'index.json'))
+        # Without the previous build's index there's nothing to update.
+        self.fresh = not (state.get('options') == self.options and index)
+        if not self.fresh:
+            self.routes = state.get('routes', {})
+            self.shards = set(index.get('shards', []))
+        self.written = []  # type: List[str]
+
+    def _shard(self, word: str) -> str:
+        return word[:self.prefix]
+
+    def _shard_file(self, shard: str) -> str:
+        # Shards are kept apart from the other files, which words
+        # could otherwise be named like.
+        return os.path.join(self.directory, 'words', shard + '.json')
+
+    def _docs_file(self, number: int) -> str:
+        return os.path.join(self.directory, 'docs-%d.json' % number)
+
+    def _indexed(self, routes: Iterable, manifest) -> Iterable:
+        for route in routes:
+            entry = manifest.route(route.path)
+            if not route.template or not entry or not entry.get('output'):
+                continue
+            if route.data.get('search', True) is False:
+                continue
+            path = route.url.lstrip('/')
+            if any(fnmatch.fnmatch(path, pattern) for pattern in self.exclude):
+                continue
+            yield route, entry
+
+    def _read(self, route, entry: Dict[str, Any]) -> Tuple[str, Set[str]]:
+        output = os.path.join(self.output_dir, entry['output'])
+        try:
+            with open(output, 'r', encoding='utf8', errors='replace') as f:
+                title, text = extract(f.read())
+        except OSError:
+            title, text = '', ''
+        title = str(route.data.get('title') or title or route.url)
+        texts = [title, text] + _docs(route.data)
+        return title, words(' '.join(texts), self.min_length)
+
+    def update(self, routes: Iterable, manifest) -> Tuple[int, List[str]]:
+        """Index changed routes; returns how many and the index files."""
+        if self.fresh and os.path.isdir(self.directory):
+            shutil.rmtree(self.directory)
+        os.makedirs(os.path.join(self.directory, 'words'), exist_ok=True)
+        changed = {}  # type: Dict[str, Tuple[Any, str, Set[str]]]
+        seen = set()
+        for route, entry in self._indexed(routes, manifest):
+            seen.add(route.path)
+            # `files` covers `!data-doc` files that aren't rendered.
+            key = fingerprint([entry.get('hash'), entry.get('files'),
+                               route.url, route.data.get('title')])
+            previous = self.routes.get(route.path)
+            if previous and previous[1] == key:
+                continue
+            title, found = self._read(route, entry)
+            changed[route.path] = (route, title, found)
+            if previous:
+                previous[1] = key
+            else:
+                self.routes[route.path] = [None, key, []]
+        removed = [path for path in self.routes if path not in seen]
+
+        # Shards and ids the previous postings of these routes are in.
+        affected = set()  # type: Set[str]
+        stale = set()  # type: Set[int]
+        for path in list(changed) + removed:
+            record = self.routes[path]
+            affected.update(record[2])
+            if record[0] is not None:
+                stale.add(record[0])
+        free = sorted((self.routes.pop(path)[0] for path in removed),
+                      reverse=True)
+        next_id = max([record[0] for record in self.routes.values()
+                       if record[0] is not None] + free + [-1]) + 1
+        postings = {}  # type: Dict[str, Dict[str, List[int]]]
+        for path, (_, _, found) in changed.items():
+            record = self.routes[path]
+            if record[0] is None:
+                # Ids of removed routes are given to new ones.
+                if free:
+                    record[0] = free.pop()
+                else:
+                    record[0] = next_id
+                    next_id += 1
+                stale.add(record[0])
+            prefixes = set()
+            for word in found:
+                shard = self._shard(word)
+                prefixes.add(shard)
+                postings.setdefault(shard, {}).setdefault(
+                    word, []).append(record[0])
+            record[2] = sorted(prefixes)
+            affected.update(prefixes)
+
+        for shard in sorted(affected):
+            self._write_shard(shard, stale, postings.get(shard, {}))
+        self._write_docs(changed, stale, next_id)
+        self._write_index(next_id)
+        return len(changed), self.files(next_id)
+
+    def _write_shard(self, shard: str, stale: Set[int],
+                     postings: Dict[str, List[int]]) -> None:
+        path = self._shard_file(shard)
+        words = {}
+        if shard in self.shards:
+            words = _read_json(path) or {}
+        for word in list(words):
+            ids = [doc_id for doc_id in words[word] if doc_id not in stale]
+            if ids:
+                words[word] = ids
+            else:
+                del words[word]
+        for word, ids in postings.items():
+            words[word] = sorted(set(words.get(word, [])).union(ids))
+        if words:
+            _write_json(path, words)
+            self.written.append(path)
+            self.shards.add(shard)
+        elif shard in self.shards:
+            self.shards.discard(shard)
+            if os.path.isfile(path):
+                os.remove(path)
+                remove_variants(path)
+
+    def _write_docs(self, changed: Dict[str, Tuple], stale: Set[int],
+                    count: int) -> None:
+        docs = {}  # type: Dict[int, Optional[List[str]]]
+        for doc_id in stale:
+            docs[doc_id] = None
+        for path, (route, title, _) in changed.items():
+            docs[self.routes[path][0]] = [route.url, title]
+        numbers = set(doc_id // DOCS_PER_FILE for doc_id in docs)
+        for number in sorted(numbers):
+            path = self._docs_file(number)
+            entries = None if self.fresh else _read_json(path)
+            if not isinstance(entries, list):
+                entries = []
+            size = min(DOCS_PER_FILE, count - number * DOCS_PER_FILE)
+            entries = (entries + [None] * size)[:size]
+            for doc_id, doc in docs.items():
+                if doc_id // DOCS_PER_FILE == number:
+                    entries[doc_id % DOCS_PER_FILE] = doc
+            _write_json(path, entries)
+            self.written.append(path)
+
+    def _write_index(self, count: int) -> None:
+        path = os.path.join(self.directory, 'index.json')
+        index = {
+            'version': INDEX_VERSION,
+            'prefix': self.prefix,
+            'shards': sorted(self.shards),
+            'docs': DOCS_PER_FILE,
+            'files': -(-count // DOCS_PER_FILE),
+        }
+        if _read_json(path) != index:
+            _write_json(path, index)
+            self.written.append(path)
+
+    def state(self) -> Dict[str, Any]:
+        """What's in the index, for `save_state()`."""
+        return {'options': self.options, 'routes': self.routes}
+
+    def files(self, count: int) -> List[str]:
+        """Every file of the index."""
+        files = [os.path.join(self.directory, 'index.json')]
+        files.extend(self._shard_file(shard)
+                     for shard in sorted(self.shards))
+        files.extend(self._docs_file(number)
+                     for number in range(-(-count // DOCS_PER_FILE)))
+        return files
+
+
+def write_search_index(routes: Iterable, manifest, output_dir: str,
+                       config: Dict[str, Any], cache_dir: str
+                       ) -> Tuple[int, List[str], List[str],
+                                  Dict[str, Any]]:
+    """Update the search index set up in `config`.
+
+    Returns how many routes were indexed again, every file of the
+    index, the files written and the state to `save_state()` once the
+    build is in place.
+    """
+    from .main import _fatal
+
+    options = config.get('search')
+    if not isinstance(options, dict):
+        options = {}
+    path = os.path.normpath(options.get('path', 'search'))
+    if path == '.' or path.startswith('..') or os.path.isabs(path):
+        _fatal("the search index needs a 'path' inside the build "
+               "directory.")
+    index = SearchIndex(output_dir, options, cache_dir)
+    indexed, files = index.update(routes, manifest)
+    return indexed, files, index.written, index.state()
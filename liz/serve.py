@@ -0,0 +1,217 @@
+"""Development server for liz projects.
+
+`liz serve` keeps the parsed config, routes and Jinja environment in
+memory, renders pages into memory rather than `build/`, and re-renders
+only the routes whose inputs changed whenever a watched file is
+modified.  HTML pages get a small script that reloads the browser once
+a rebuild finishes.
+"""
+import mimetypes
+import os
+import threading
+import time
+import traceback
+
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Iterable, List, Set
+from urllib.parse import parse_qs, urlsplit
+
+from .main import (RouteTable, bytecode_dir, config_fn,
+                   get_template_globals, iter_routes, load_config,
+                   load_routes)
+from .manifest import Manifest
+from .render import check_urls, make_env, render_content
+from .watch import make_watcher
+
+RELOAD_PATH = '/__liz__/reload'
+
+RELOAD_SCRIPT = """
+<script>
+new EventSource("%s?v=%%d").onmessage = function () {
+  location.reload();
+};
+</script>
+""" % RELOAD_PATH
+
+
+def _output(path: str) -> str:
+    # Matches where `build` ends up writing a route.
+    if not path or path.endswith('/'):
+        return path + 'index.html'
+    return path
+
+
+class Site:
+    """A liz project held in memory between rebuilds."""
+
+    def __init__(self):
+        self.pages = {}  # type: Dict[str, bytes]
+        self.entries = {}  # type: Dict[str, Dict]
+        self.files = set()  # type: Set[str]
+        self.globals = None
+        self.version = 0
+        self.changed = threading.Condition()
+        self.load()
+        self.render()
+
+    def load(self) -> None:
+        """(Re)read the config and routes and set up the environment."""
+        config = load_config()
+        routes = load_routes(config)
+        self.config = config
+        self.routes = routes
+        self.templates_dir = config.get('templates') or "."
+        self.build_dir = config.get('build') or "build/"
+        self.table = RouteTable(config, routes, self.build_dir)
+        self.urls = self.table.urls
+        self.template_globals = get_template_globals(config, self.build_dir)
+        self.env = make_env(self.templates_dir, self.urls,
+                            self.template_globals, bytecode_dir)
+
+    def watched(self) -> List[str]:
+        paths = [config_fn, self.templates_dir]
+        if self.config.get('assets'):
+            paths.append(self.config['assets'])
+        routes_fn = self.config.get('routes')
+        if type(routes_fn) is str:
+            paths.append(routes_fn)
+        return paths + sorted(self.files)
+
+    def render(self) -> None:
+        """Render every route whose inputs changed since the last pass."""
+        start = time.time()
+        manifest = Manifest(None, {
+            'urls': self.urls,
+            'config': self.template_globals,
+            'path-suffix': self.config.get('path-suffix'),
+        })
+        stale = manifest.globals != self.globals
+        templates = manifest.all_template_deps(self.env, self.table.templates)
+        for problem in check_urls(self.env, templates, self.urls):
+            print("warning: " + problem)
+        pages = {}
+        entries = {}
+        files = set()
+        rendered = 0
+        for path, template, data in iter_routes(self.config, self.table,
+                                                self.build_dir):
+            output = _output(path)
+            try:
+                entry = manifest.entry(self.env, template, data)
+                files.update(entry['files'])
+                if (not stale and output in self.pages and
+                        self.entries.get(path) == entry):
+                    pages[output] = self.pages[output]
+                else:
+                    content = render_content(self.env, template, data)
+                    pages[output] = content.encode('utf8')
+                    rendered += 1
+                entries[path] = entry
+            except Exception:
+                print("error: couldn't render '%s':" % path)
+                traceback.print_exc()
+        with self.changed:
+            self.pages = pages
+            self.entries = entries
+            self.files = files
+            self.globals = manifest.globals
+            self.version += 1
+            self.changed.notify_all()
+        print("rendered %d of %d routes in %.0fms" % (
+            rendered, len(entries), (time.time() - start) * 1000))
+
+    def update(self, changed: Iterable[str]) -> None:
+        """React to changed files."""
+        templates_dir = os.path.normpath(self.templates_dir)
+        # Template edits are picked up by the environment itself; any
+        # other watched file feeds into the config or routes.
+        reload = any(not os.path.normpath(path).startswith(templates_dir)
+                     for path in changed)
+        try:
+            if reload:
+                self.load()
+            self.render()
+        except (Exception, SystemExit):
+            # Keep serving the last good build until the error is fixed.
+            traceback.print_exc()
+
+    def page(self, url: str):
+        path = os.path.join(self.build_dir, url.lstrip('/'))
+        for candidate in (path, _output(path), path + '/index.html'):
+            if candidate in self.pages:
+                return candidate, self.pages[candidate]
+        return None, None
+
+
+def make_handler(site: Site):
+    class Handler(SimpleHTTPRequestHandler):
+
+        def do_GET(self):
+            url = urlsplit(self.path)
+            if url.path == RELOAD_PATH:
+                return self.wait_for_reload(url.query)
+            path, content = site.page(url.path)
+            if content is None:
+                # Fall back to files in the build directory, like
+                # fingerprinted assets, then to the project itself.
+                built = os.path.join(site.build_dir, url.path.lstrip('/'))
+                if os.path.isfile(built):
+                    self.path = '/' + built
+                return super().do_GET()
+            ctype = mimetypes.guess_type(path)[0] or 'text/html'
+            if ctype == 'text/html':
+                content += (RELOAD_SCRIPT % site.version).encode('utf8')
+            self.send_response(200)
+            self.send_header('Content-Type', ctype)
+            self.send_header('Content-Length', str(len(content)))
+            self.send_header('Cache-Control', 'no-cache')
+            self.end_headers()
+            self.wfile.write(content)
+
+        def wait_for_reload(self, query: str):
+            try:
+                seen = int(parse_qs(query).get('v', ['0'])[0])
+            except ValueError:
+                seen = 0
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/event-stream')
+            self.send_header('Cache-Control', 'no-cache')
+            self.end_headers()
+            try:
+                while True:
+                    with site.changed:
+                        site.changed.wait_for(lambda: site.version != seen,
+                                              timeout=15)
+                    if site.version != seen:
+                        self.wfile.write(b'data: reload\n\n')
+                        self.wfile.flush()
+                        return
+                    # Keeps the connection alive and notices closed tabs.
+                    self.wfile.write(b': ping\n\n')
+                    self.wfile.flush()
+            except (BrokenPipeError, ConnectionResetError):
+                pass
+
+        def log_message(self, format, *args):
+            pass
+
+    return Handler
+
+
+def serve(port: int) -> None:
+    site = Site()
+    server = ThreadingHTTPServer(('localhost', port), make_handler(site))
+    server.daemon_threads = True
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    print("serving on http://localhost:%d" % port)
+
+    watcher = make_watcher(site.watched())
+    try:
+        while True:
+            changed = watcher.wait()
+            print("changed: " + ", ".join(sorted(changed)))
+            site.update(changed)
+            watcher.watch(site.watched())
+    except KeyboardInterrupt:
+        server.shutdown()
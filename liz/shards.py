@@ -0,0 +1,114 @@
+"""Routes split across many files.
+
+`routes:` in liz.yml can name a directory or a glob of JSON, YAML and
+JSON Lines files instead of a single routes file.  Each shard holds a
+list of routes (or a single route) and shards are read in sorted
+order.
+
+Parsed shards are pickled into the cache directory, keyed by their
+modification time and size, so an unchanged shard is never parsed
+twice.  On a cold cache the shards are parsed in a process pool.
+"""
+import glob
+import hashlib
+import os
+import pickle
+
+from typing import Dict, List, Optional, Tuple
+
+import yaml
+
+from .data import _filetype, _has_tags, load_file
+from .main import _fatal, cache_dir
+from .output import atomic_write
+
+shards_dir = os.path.join(cache_dir, 'shards')
+
+
+def is_sharded(routes_fn: str) -> bool:
+    return os.path.isdir(routes_fn) or glob.has_magic(routes_fn)
+
+
+def find_shards(routes_fn: str) -> List[str]:
+    if os.path.isdir(routes_fn):
+        filenames = []
+        for dirpath, _, names in os.walk(routes_fn):
+            filenames.extend(os.path.join(dirpath, name) for name in names)
+    else:
+        filenames = glob.glob(routes_fn, recursive=True)
+    return sorted(fn for fn in filenames
+                  if os.path.isfile(fn) and _filetype(fn))
+
+
+def _cache_fn(filename: str) -> str:
+    key = hashlib.sha1(os.path.abspath(filename).encode('utf8')).hexdigest()
+    return os.path.join(shards_dir, key + '.pickle')
+
+
+def _stamp(filename: str) -> Tuple[int, int]:
+    st = os.stat(filename)
+    return st.st_mtime_ns, st.st_size
+
+
+def _cached(filename: str) -> Optional[List[Dict]]:
+    try:
+        with open(_cache_fn(filename), 'rb') as f:
+            stamp, routes = pickle.load(f)
+    except (OSError, EOFError, pickle.UnpicklingError, ValueError):
+        return None
+    if stamp != list(_stamp(filename)):
+        return None
+    return routes
+
+
+def parse_shard(filename: str) -> List[Dict]:
+    """Parse a shard and cache the result, returning its routes."""
+    stamp = _stamp(filename)
+    try:
+        routes = load_file(filename)
+    except (ValueError, yaml.YAMLError) as e:
+        raise ValueError("%s: %s" % (filename, e))
+    if isinstance(routes, dict):
+        routes = [routes]
+    routes = routes or []
+    # Tags like `!sh` or `!file` depend on more than the shard itself,
+    # so shards that use them are always parsed again.
+    if not _has_tags(routes):
+        os.makedirs(shards_dir, exist_ok=True)
+        atomic_write(_cache_fn(filename),
+                     pickle.dumps((list(stamp), routes),
+                                  pickle.HIGHEST_PROTOCOL))
+    return routes
+
+
+def load_shards(routes_fn: str, processes: Optional[int] = None) -> List[Dict]:
+    """Load every route from the shards matching `routes_fn`."""
+    filenames = find_shards(routes_fn)
+    if not filenames:
+        _fatal("no routes found in '%s'." % routes_fn)
+    shards = {}
+    missing = []
+    for filename in filenames:
+        routes = _cached(filename)
+        if routes is None:
+            missing.append(filename)
+        else:
+            shards[filename] = routes
+
+    try:
+        if len(missing) > 1 and processes != 1:
+            from concurrent.futures import ProcessPoolExecutor
+            with ProcessPoolExecutor(processes) as pool:
+                for filename, routes in zip(missing,
+                                            pool.map(parse_shard, missing)):
+                    shards[filename] = routes
+        else:
+            for filename in missing:
+                shards[filename] = parse_shard(filename)
+    except ValueError as e:
+        _fatal("couldn't parse routes in %s" % e)
+
+    routes = []
+    for filename in filenames:
+        routes.extend(shards[filename])
+    return routes
@@ -0,0 +1,258 @@
+"""Sitemaps and an Atom feed written straight from the routes.
+
+    sitemap:
+      base-url: https://example.com
+      max-urls: 50000
+      exclude: ['404.html', 'drafts/*']
+    feed:
+      path: feed.xml
+      title: Example
+      limit: 20
+
+Every route with a template is listed in `sitemap.xml`, unless its
+path matches `exclude` or its data sets `sitemap: false`.  Past
+`max-urls` routes, `sitemap.xml` becomes an index of `sitemap-1.xml`,
+`sitemap-2.xml` and so on.  The feed lists the `limit` newest routes
+whose data has a `date`, with their `title` and `summary`; routes can
+leave it out with `feed: false`.  `base-url` falls back to the one at
+the top of liz.yml.
+
+Routes are streamed and entries written as they come, so memory use
+doesn't grow with the number of routes.  A first pass hashes every
+sitemap file's entries; only the files whose hash changed since the
+last build are written again.
+"""
+import fnmatch
+import hashlib
+import heapq
+import os
+
+from datetime import date, datetime
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+from xml.sax.saxutils import escape
+
+from .compress import remove_variants
+from .output import atomic_write, load_state
+
+MAX_URLS = 50000
+FEED_LIMIT = 20
+
+# Hashes of what was last written, kept in the cache directory.
+STATE = 'sitemap.json'
+
+SITEMAP_NS = 'http://www.sitemaps.org/schemas/sitemap/0.9'
+ATOM_NS = 'http://www.w3.org/2005/Atom'
+
+
+def _timestamp(value: Any) -> Optional[str]:
+    """Turn a route's `date` into an RFC 3339 timestamp."""
+    if isinstance(value, datetime):
+        if value.tzinfo is None:
+            return value.isoformat() + 'Z'
+        return value.isoformat()
+    if isinstance(value, date):
+        return value.isoformat() + 'T00:00:00Z'
+    if isinstance(value, str) and value:
+        return value + 'T00:00:00Z' if len(value) == 10 else value
+    return None
+
+
+def _pages(routes: Iterable, key: str, exclude: List[str] = ()) -> Iterator:
+    for route in routes:
+        if not route.template or '://' in route.url:
+            continue
+        if route.data.get(key, True) is False:
+            continue
+        path = route.url.lstrip('/')
+        if any(fnmatch.fnmatch(path, pattern) for pattern in exclude):
+            continue
+        yield route
+
+
+class Sitemaps:
+    """Writes `sitemap.xml`, split into shards when it gets too long."""
+
+    def __init__(self, output_dir: str, base_url: str,
+                 max_urls: int = MAX_URLS, exclude: List[str] = ()):
+        self.output_dir = output_dir
+        self.base_url = base_url.rstrip('/')
+        self.max_urls = max_urls
+        self.exclude = list(exclude)
+
+    def _entries(self, routes: Iterable) -> Iterator[str]:
+        for route in _pages(routes, 'sitemap', self.exclude):
+            entry = '<url><loc>%s</loc>' % escape(self.base_url + route.url)
+            lastmod = _timestamp(route.data.get('date'))
+            if lastmod:
+                entry += '<lastmod>%s</lastmod>' % escape(lastmod)
+            yield entry + '</url>\n'
+
+    def _hashes(self, routes: Iterable) -> List[str]:
+        hashes = []
+        hasher = None
+        for i, entry in enumerate(self._entries(routes)):
+            if i % self.max_urls == 0:
+                if hasher:
+                    hashes.append(hasher.hexdigest())
+                hasher = hashlib.sha1()
+            hasher.update(entry.encode('utf8'))
+        if hasher:
+            hashes.append(hasher.hexdigest())
+        # No routes still make an (empty) sitemap.
+        return hashes or [hashlib.sha1().hexdigest()]
+
+    def filename(self, shard: int, shards: int) -> str:
+        if shards <= 1:
+            return 'sitemap.xml'
+        return 'sitemap-%d.xml' % (shard + 1)
+
+    def _urlset(self, entries: Iterable[str]) -> Iterator[str]:
+        yield '<?xml version="1.0" encoding="UTF-8"?>\n'
+        yield '<urlset xmlns="%s">\n' % SITEMAP_NS
+        yield from entries
+        yield '</urlset>\n'
+
+    def _index(self, shards: int) -> Iterator[str]:
+        yield '<?xml version="1.0" encoding="UTF-8"?>\n'
+        yield '<sitemapindex xmlns="%s">\n' % SITEMAP_NS
+        for shard in range(shards):
+            yield '<sitemap><loc>%s/%s</loc></sitemap>\n' % (
+                escape(self.base_url), self.filename(shard, shards))
+        yield '</sitemapindex>\n'
+
+    def write(self, routes: Iterable,
+              previous: List[str]) -> Tuple[List[str], List[str], List[str]]:
+        """Write changed sitemap files.
+
+        `routes` is iterated twice.  Returns the hashes of this build's
+        files, every sitemap file and the files that were written.
+        """
+        hashes = self._hashes(routes)
+        shards = len(hashes)
+        paths = [os.path.join(self.output_dir, self.filename(i, shards))
+                 for i in range(shards)]
+        # Shards are named differently once there's more than one.
+        resharded = len(previous) != shards
+        stale = set(i for i in range(shards)
+                    if resharded or previous[i] != hashes[i] or
+                    not os.path.isfile(paths[i]))
+        written = []
+        if stale:
+            entries = iter(self._entries(routes))
+            for shard in range(shards):
+                chunk = (entry for _, entry in
+                         zip(range(self.max_urls), entries))
+                if shard in stale:
+                    atomic_write(paths[shard], ''.join(self._urlset(chunk)))
+                    written.append(paths[shard])
+                else:
+                    for _ in chunk:
+                        pass
+        files = list(paths)
+        if shards > 1:
+            index = os.path.join(self.output_dir, 'sitemap.xml')
+            if stale or not os.path.isfile(index):
+                atomic_write(index, ''.join(self._index(shards)))
+                written.append(index)
+            files.append(index)
+        # Shards left over from a build with more routes.
+        for shard in range(shards if shards > 1 else 0, len(previous)):
+            path = os.path.join(self.output_dir,
+                                'sitemap-%d.xml' % (shard + 1))
+            if os.path.isfile(path):
+                os.remove(path)
+                remove_variants(path)
+        return hashes, files, written
+
+
+def _feed_entries(routes: Iterable, limit: int) -> List[Tuple]:
+    dated = ((_timestamp(route.data.get('date')), i, route)
+             for i, route in enumerate(_pages(routes, 'feed')))
+    # Keeps at most `limit` routes around, however many there are.
+    return heapq.nlargest(limit, ((stamp, -i, route)
+                                  for stamp, i, route in dated if stamp),
+                          key=lambda entry: entry[:2])
+
+
+def _atom(options: Dict[str, Any], base_url: str, path: str,
+          entries: List[Tuple]) -> Iterator[str]:
+    yield '<?xml version="1.0" encoding="UTF-8"?>\n'
+    yield '<feed xmlns="%s">\n' % ATOM_NS
+    yield '<title>%s</title>\n' % escape(str(options.get('title', '')))
+    yield '<id>%s/%s</id>\n' % (escape(base_url), escape(path))
+    yield '<link rel="self" href="%s/%s"/>\n' % (escape(base_url),
+                                                 escape(path))
+    if entries:
+        yield '<updated>%s</updated>\n' % escape(entries[0][0])
+    for stamp, _, route in entries:
+        link = escape(base_url + route.url)
+        yield '<entry>\n'
+        yield '<title>%s</title>\n' % escape(
+            str(route.data.get('title') or route.url))
+        yield '<id>%s</id>\n<link href="%s"/>\n' % (link, link)
+        yield '<updated>%s</updated>\n' % escape(stamp)
+        summary = route.data.get('summary')
+        if summary:
+            yield '<summary>%s</summary>\n' % escape(str(summary))
+        yield '</entry>\n'
+    yield '</feed>\n'
+
+
+def write_feed(routes: Iterable, output_dir: str, options: Dict[str, Any],
+               base_url: str, previous: Optional[str]
+               ) -> Tuple[str, str, bool]:
+    """Write the Atom feed if it changed.
+
+    Returns the feed's hash, its file and whether it was written.
+    """
+    path = options.get('path', 'feed.xml')
+    base_url = base_url.rstrip('/')
+    entries = _feed_entries(routes, int(options.get('limit', FEED_LIMIT)))
+    hasher = hashlib.sha1()
+    for chunk in _atom(options, base_url, path, entries):
+        hasher.update(chunk.encode('utf8'))
+    feed_hash = hasher.hexdigest()
+    filename = os.path.join(output_dir, path)
+    if feed_hash == previous and os.path.isfile(filename):
+        return feed_hash, filename, False
+    os.makedirs(os.path.dirname(filename) or '.', exist_ok=True)
+    atomic_write(filename, ''.join(_atom(options, base_url, path, entries)))
+    return feed_hash, filename, True
+
+
+def write_sitemaps(routes: Iterable, output_dir: str,
+                   config: Dict[str, Any], cache_dir: str
+                   ) -> Tuple[List[str], List[str], Dict[str, Any]]:
+    """Write the sitemap and feed set up in `config`.
+
+    Returns every file they're made of, the files written and the
+    state to `save_state()` once the build is in place; saving it any
+    earlier would let a failed build skip files it never put there.
+    """
+    from .main import _fatal
+
+    state = load_state(cache_dir, STATE)
+    files = []
+    written = []
+    for key in ('sitemap', 'feed'):
+        options = config.get(key)
+        if not options:
+            continue
+        if not isinstance(options, dict):
+            options = {}
+        base_url = options.get('base-url') or config.get('base-url')
+        if not base_url:
+            _fatal("'%s' needs a 'base-url'." % key)
+        if key == 'sitemap':
+            sitemaps = Sitemaps(output_dir, base_url,
+                                int(options.get('max-urls', MAX_URLS)),
+                                options.get('exclude') or [])
+            state[key], paths, changed = sitemaps.write(
+                routes, state.get(key) or [])
+        else:
+            state[key], path, was_written = write_feed(
+                routes, output_dir, options, base_url, state.get(key))
+            paths, changed = [path], [path] if was_written else []
+        files.extend(paths)
+        written.extend(changed)
+    return files, written, state
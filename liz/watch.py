@@ -0,0 +1,151 @@
+"""File watching for `liz serve`.
+
+On Linux, changes are picked up with inotify (through ctypes, so no
+extra dependency is needed).  Elsewhere the watched files are polled
+for changes in their modification times.
+"""
+import ctypes
+import ctypes.util
+import os
+import select
+import struct
+import time
+
+from typing import Dict, Iterable, Set
+
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_EVENTS = (IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO |
+             IN_CREATE | IN_DELETE)
+
+_EVENT = struct.Struct('iIII')
+
+# How long to keep collecting events once a change has been seen, so
+# an editor saving several files at once only causes one rebuild.
+SETTLE_TIME = 0.05
+
+
+def _walk(paths: Iterable[str]) -> Iterable[str]:
+    for path in paths:
+        if os.path.isdir(path):
+            for dirpath, _, filenames in os.walk(path):
+                yield dirpath
+                for fn in filenames:
+                    yield os.path.join(dirpath, fn)
+        else:
+            yield path
+
+
+class PollingWatcher:
+    """Watch files by comparing their modification times."""
+
+    interval = 0.25
+
+    def __init__(self, paths: Iterable[str]):
+        self.watch(paths)
+
+    def _stat(self) -> Dict[str, float]:
+        mtimes = {}
+        for path in _walk(self.paths):
+            try:
+                mtimes[path] = os.stat(path).st_mtime
+            except OSError:
+                pass
+        return mtimes
+
+    def watch(self, paths: Iterable[str]) -> None:
+        self.paths = set(paths)
+        self.mtimes = self._stat()
+
+    def wait(self) -> Set[str]:
+        """Block until something changes and return the changed paths."""
+        while True:
+            time.sleep(self.interval)
+            mtimes = self._stat()
+            changed = {path for path in set(mtimes) | set(self.mtimes)
+                       if mtimes.get(path) != self.mtimes.get(path)}
+            self.mtimes = mtimes
+            if changed:
+                return changed
+
+
+class InotifyWatcher:
+    """Watch files and directory trees with inotify."""
+
+    def __init__(self, paths: Iterable[str]):
+        libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        self._add_watch = libc.inotify_add_watch
+        self._rm_watch = libc.inotify_rm_watch
+        self.fd = libc.inotify_init()
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init failed")
+        self.dirs = {}  # type: Dict[int, str]
+        self.watch(paths)
+
+    def watch(self, paths: Iterable[str]) -> None:
+        for wd in list(self.dirs):
+            self._rm_watch(self.fd, wd)
+        self.dirs = {}
+        # Editors often save by renaming a new file over the old one,
+        # so files are watched through their parent directories.
+        self.files = set()
+        self.trees = set()
+        for path in set(paths):
+            path = os.path.normpath(path)
+            if os.path.isdir(path):
+                self.trees.add(path)
+                for dirpath, _, _ in os.walk(path):
+                    self._watch_dir(dirpath)
+            else:
+                self.files.add(path)
+                self._watch_dir(os.path.dirname(path) or '.')
+
+    def _watch_dir(self, path: str) -> None:
+        wd = self._add_watch(self.fd, os.fsencode(path), IN_EVENTS)
+        if wd >= 0:
+            self.dirs[wd] = path
+
+    def _in_tree(self, path: str) -> bool:
+        return any(path == tree or path.startswith(tree + os.sep)
+                   for tree in self.trees)
+
+    def _read(self) -> Set[str]:
+        changed = set()
+        buf = os.read(self.fd, 64 * 1024)
+        offset = 0
+        while offset < len(buf):
+            wd, mask, _, length = _EVENT.unpack_from(buf, offset)
+            offset += _EVENT.size
+            name = buf[offset:offset + length].rstrip(b'\0')
+            offset += length
+            if wd not in self.dirs:
+                continue
+            path = os.path.normpath(
+                os.path.join(self.dirs[wd], os.fsdecode(name)))
+            if path in self.files or self._in_tree(path):
+                changed.add(path)
+                # New directories inside a watched tree need watches too.
+                if mask & (IN_CREATE | IN_MOVED_TO) and os.path.isdir(path):
+                    self._watch_dir(path)
+        return changed
+
+    def wait(self) -> Set[str]:
+        """Block until something changes and return the changed paths."""
+        changed = set()
+        while not changed:
+            select.select([self.fd], [], [])
+            changed |= self._read()
+        while select.select([self.fd], [], [], SETTLE_TIME)[0]:
+            changed |= self._read()
+        return changed
+
+
+def make_watcher(paths: Iterable[str]):
+    try:
+        return InotifyWatcher(paths)
+    except (OSError, AttributeError, TypeError):
+        return PollingWatcher(paths)